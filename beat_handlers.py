@@ -0,0 +1,140 @@
+import numpy as np
+
+from models import BEATS_PER_BAR
+from proto.beats_pb2 import BeatGrid, BeatMap
+
+# Protobuf tags in a serialised BeatMap: beat messages, and each beat's position, enabled and source fields
+BEATMAP_BEAT_TAG = 0x0A
+BEAT_FRAME_POSITION_TAG = 0x08
+BEAT_ENABLED_TAG = 0x10
+BEAT_SOURCE_TAG = 0x18
+BEAT_FIELD_TAGS = (BEAT_FRAME_POSITION_TAG, BEAT_ENABLED_TAG, BEAT_SOURCE_TAG)
+# Relative change in beat length that starts a new TEMPO, well above the frame rounding in Mixxx's beat maps
+TEMPO_CHANGE_TOLERANCE = 0.001
+
+
+def parse_beatmap_fields(beatmap_bytes: bytes) -> tuple[np.ndarray, ...]:
+    beatmap = BeatMap()
+    beatmap.ParseFromString(beatmap_bytes)
+    return (
+        np.array([beat.frame_position for beat in beatmap.beat], dtype=np.int64),
+        np.array([beat.enabled for beat in beatmap.beat], dtype=bool),
+        np.array([beat.source for beat in beatmap.beat], dtype=np.int64),
+    )
+
+
+def decode_beatmap_fields(beatmap_bytes: bytes) -> tuple[np.ndarray, ...] | None:
+    # Every field in a BeatMap is a varint or a beat message made of varints, so the bytes are one flat
+    # run of varints alternating between tags and values. When every beat has the same fields they line
+    # up into a table that can be decoded at once, without building a protobuf object per beat.
+    data = np.frombuffer(beatmap_bytes, dtype=np.uint8)
+    varint_ends = np.flatnonzero(data < 0x80)
+    if not len(varint_ends) or varint_ends[-1] != len(data) - 1 or len(varint_ends) % 2:
+        return None
+    tag_ends, value_ends = varint_ends[0::2], varint_ends[1::2]
+    tags = data[tag_ends]
+    if tags[0] != BEATMAP_BEAT_TAG:
+        return None
+    next_beat = np.flatnonzero(tags[1 : len(BEAT_FIELD_TAGS) + 2] == BEATMAP_BEAT_TAG)
+    fields_per_beat = int(next_beat[0]) + 1 if len(next_beat) else len(tags)
+    if len(tags) % fields_per_beat:
+        return None
+    beat_tags = tags.reshape(-1, fields_per_beat)
+    field_tags = beat_tags[0, 1:].tolist()
+    if (
+        BEAT_FRAME_POSITION_TAG not in field_tags
+        or len(set(field_tags)) != len(field_tags)
+        or not set(field_tags) <= set(BEAT_FIELD_TAGS)
+        or not (beat_tags == beat_tags[0]).all()
+    ):
+        return None
+
+    beat_count = len(beat_tags)
+    # Tags, lengths, and the enabled and source values all fit in a single byte, only positions need decoding
+    beat_values = data[value_ends].reshape(-1, fields_per_beat)
+    position_column = field_tags.index(BEAT_FRAME_POSITION_TAG) + 1
+    position_ends = value_ends.reshape(-1, fields_per_beat)[:, position_column]
+    position_sizes = (
+        position_ends - tag_ends.reshape(-1, fields_per_beat)[:, position_column]
+    )
+    # Each beat message's tag, length and contents must account for every byte
+    if (
+        int(beat_values[:, 0].sum()) + 2 * beat_count != len(data)
+        or len(varint_ends) - beat_count + int(position_sizes.sum()) != len(data)
+        or position_sizes.max() > 10
+    ):
+        return None
+
+    # Varints are little endian base 128, so each position is built up from its last byte backwards.
+    # Negative int32s are sign extended to 10 bytes and wrap round to the right value.
+    frame_positions = data[position_ends].astype(np.int64)
+    for byte_index in range(1, int(position_sizes.max())):
+        frame_positions = np.where(
+            position_sizes > byte_index,
+            (frame_positions << 7) | (data[position_ends - byte_index] & 0x7F),
+            frame_positions,
+        )
+    enabled = np.ones(beat_count, dtype=bool)
+    sources = np.zeros(beat_count, dtype=np.int64)
+    if BEAT_ENABLED_TAG in field_tags:
+        enabled = beat_values[:, field_tags.index(BEAT_ENABLED_TAG) + 1] != 0
+    if BEAT_SOURCE_TAG in field_tags:
+        sources = beat_values[:, field_tags.index(BEAT_SOURCE_TAG) + 1].astype(np.int64)
+    return frame_positions, enabled, sources
+
+
+def get_beat_positions(beatmap_bytes: bytes) -> np.ndarray:
+    frame_positions, enabled, sources = decode_beatmap_fields(
+        beatmap_bytes
+    ) or parse_beatmap_fields(beatmap_bytes)
+    usable = enabled & (frame_positions > 1)
+    if not usable.any():
+        return frame_positions[:0]
+    # Beats set by the user win over ones from file metadata, which win over the analyser's
+    usable &= sources == sources[usable].max()
+    return np.sort(frame_positions[usable])
+
+
+def get_tempo_changes(beat_positions: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Splits the beats wherever the gap between them changes, returning the index of each
+    # segment's first beat and the segment's average beat length in frames
+    beat_lengths = np.diff(beat_positions)
+    if not len(beat_lengths):
+        return np.zeros(1, dtype=np.int64), np.zeros(1)
+    is_change = (
+        np.abs(np.diff(beat_lengths)) > beat_lengths[:-1] * TEMPO_CHANGE_TOLERANCE
+    )
+    segment_starts = np.concatenate(([0], np.flatnonzero(is_change) + 1))
+    segment_ends = np.append(segment_starts[1:], len(beat_lengths))
+    segment_lengths = (
+        beat_positions[segment_ends] - beat_positions[segment_starts]
+    ) / (segment_ends - segment_starts)
+    return segment_starts, segment_lengths
+
+
+def read_beatgrid(beat_bytes: bytes) -> tuple[int, float]:
+    beatgrid = BeatGrid()
+    beatgrid.ParseFromString(beat_bytes)
+    return beatgrid.first_beat.frame_position, beatgrid.bpm.bpm
+
+
+def read_beatmap(
+    beat_bytes: bytes, samplerate: float
+) -> tuple[int, float | None, list[tuple[int, float, int]]]:
+    beat_positions = get_beat_positions(beat_bytes)
+    start_pos = int(beat_positions[0]) if len(beat_positions) else 0
+    segment_starts, segment_lengths = get_tempo_changes(beat_positions)
+    # A constant tempo map gets its BPM from the track context instead
+    if len(segment_starts) == 1:
+        return start_pos, None, []
+    segment_bpms = 60 * samplerate / segment_lengths
+    return (
+        start_pos,
+        float(segment_bpms[0]),
+        [
+            (int(beat_positions[start]), float(bpm), start % BEATS_PER_BAR + 1)
+            for start, bpm in zip(
+                segment_starts[1:].tolist(), segment_bpms[1:].tolist()
+            )
+        ],
+    )
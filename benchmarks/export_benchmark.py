@@ -0,0 +1,211 @@
+import argparse
+from collections.abc import Callable
+from contextlib import chdir, nullcontext, redirect_stderr, redirect_stdout
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import sys
+import tempfile
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from lxml import etree
+
+from benchmarks.generate_mixxx_db import create_mixxx_db
+from handlers import sql as sql_handlers
+from handlers.export import TrackTask, export_to_rekordbox_xml, get_exported_track
+from models import ExportOptions, KeyType
+from offset_handlers import probe_offset_ms
+from rekordbox_gen import create_track_elm
+
+STAGES = [
+    "generate",
+    "sql",
+    "offsets",
+    "beatgrids",
+    "xml_build",
+    "serialization",
+    "end_to_end",
+    "end_to_end_cached",
+]
+PLAYLISTS_PER_1K_TRACKS = 20
+CRATES_PER_1K_TRACKS = 5
+TRACKS_PER_COLLECTION = 200
+
+arg_parser = argparse.ArgumentParser(
+    description="Time each export stage against synthetic Mixxx libraries."
+)
+arg_parser.add_argument(
+    "--scales",
+    type=int,
+    nargs="+",
+    default=[1000, 10000, 100000],
+    help="Library sizes to benchmark, in tracks. Defaults to 1000 10000 100000.",
+)
+arg_parser.add_argument(
+    "--save",
+    type=Path,
+    help="Write the results to this JSON file, e.g. a new baseline.",
+)
+arg_parser.add_argument(
+    "--compare", type=Path, help="A results JSON file to compare against."
+)
+arg_parser.add_argument(
+    "--work-dir",
+    type=Path,
+    help="Where to generate the libraries. Defaults to a temporary folder that's removed afterwards.",
+)
+
+
+def time_stage(results: dict[str, float], stage: str, func: Callable):
+    start = perf_counter()
+    value = func()
+    results[stage] = perf_counter() - start
+    return value
+
+
+def run_quietly(func: Callable) -> None:
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        func()
+
+
+def load_tracks() -> list[TrackTask]:
+    track_ids = list(
+        dict.fromkeys(
+            track_id
+            for collection_id, _ in sql_handlers.get_collections("playlists")
+            for track_id in sql_handlers.get_collection_tracks(
+                "playlists", collection_id
+            )
+        )
+    )
+    track_infos, cue_points = sql_handlers.get_tracks(track_ids)
+    return [
+        TrackTask(track_id, track_infos[track_id], cue_points.get(track_id, []))
+        for track_id in track_ids
+        if track_id in track_infos
+    ]
+
+
+def benchmark_scale(track_count: int, work_dir: Path) -> dict[str, float]:
+    results: dict[str, float] = {}
+    scale_dir = work_dir / str(track_count)
+    db_location = scale_dir / "mixxxdb.sqlite"
+    time_stage(
+        results,
+        "generate",
+        lambda: create_mixxx_db(
+            db_location,
+            scale_dir / "music",
+            track_count,
+            max(1, track_count * PLAYLISTS_PER_1K_TRACKS // 1000),
+            max(1, track_count * CRATES_PER_1K_TRACKS // 1000),
+            TRACKS_PER_COLLECTION,
+        ),
+    )
+
+    sql_handlers.set_db_location(str(db_location))
+    sql_handlers.get_connection.cache_clear()
+    track_tasks = time_stage(results, "sql", load_tracks)
+    time_stage(
+        results,
+        "offsets",
+        lambda: [
+            probe_offset_ms(track_task.track_info[-1], "MAD")
+            for track_task in track_tasks
+        ],
+    )
+    exported_tracks = time_stage(
+        results,
+        "beatgrids",
+        lambda: [
+            get_exported_track(track_task, KeyType.LANCELOT)
+            for track_task in track_tasks
+        ],
+    )
+    track_elms = time_stage(
+        results,
+        "xml_build",
+        lambda: [
+            create_track_elm(exported_track) for exported_track in exported_tracks
+        ],
+    )
+    time_stage(
+        results,
+        "serialization",
+        lambda: [etree.tostring(track_elm) for track_elm in track_elms],
+    )
+
+    options = ExportOptions(export_all=True, mixxx_db_location=str(db_location))
+    with chdir(scale_dir):
+        sql_handlers.get_connection.cache_clear()
+        time_stage(
+            results,
+            "end_to_end",
+            lambda: run_quietly(lambda: export_to_rekordbox_xml(options)),
+        )
+        # Run again, now everything's in the export cache
+        sql_handlers.get_connection.cache_clear()
+        time_stage(
+            results,
+            "end_to_end_cached",
+            lambda: run_quietly(lambda: export_to_rekordbox_xml(options)),
+        )
+    sql_handlers.get_connection().close()
+    sql_handlers.get_connection.cache_clear()
+    return results
+
+
+def print_results(results: dict[str, dict[str, float]], baseline: dict | None) -> None:
+    scales = list(results)
+    print(f"{'stage':<20}" + "".join(f"{scale + ' tracks':>24}" for scale in scales))
+    for stage in STAGES:
+        row = f"{stage:<20}"
+        for scale in scales:
+            seconds = results[scale][stage]
+            cell = f"{seconds:.3f}s"
+            baseline_seconds = (baseline or {}).get(scale, {}).get(stage)
+            if baseline_seconds:
+                cell += f" ({seconds / baseline_seconds:.2f}x)"
+            row += f"{cell:>24}"
+        print(row)
+    if baseline:
+        print("\nIn brackets: time relative to the baseline, lower is faster.")
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+    baseline = json.loads(args.compare.read_text())["results"] if args.compare else None
+
+    with (
+        tempfile.TemporaryDirectory()
+        if args.work_dir is None
+        else nullcontext(args.work_dir)
+    ) as work_dir:
+        results = {}
+        for track_count in args.scales:
+            print(f"Benchmarking {track_count} tracks...")
+            results[str(track_count)] = benchmark_scale(track_count, Path(work_dir))
+
+    print()
+    print_results(results, baseline)
+    if args.save:
+        args.save.write_text(
+            json.dumps(
+                {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpu_count": os.cpu_count(),
+                    "results": results,
+                },
+                indent=2,
+            )
+            + "\n"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import argparse
+from pathlib import Path
+import random
+import sqlite3
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from proto.beats_pb2 import BeatGrid, BeatMap, Source
+
+# The parts of Mixxx's schema the exporter reads
+MIXXX_SCHEMA = """
+CREATE TABLE track_locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    location varchar(512) UNIQUE,
+    filename varchar(512),
+    directory varchar(512),
+    filesize INTEGER,
+    fs_deleted INTEGER,
+    needs_verification INTEGER
+);
+CREATE TABLE library (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    artist varchar(64),
+    title varchar(64),
+    album varchar(64),
+    genre varchar(64),
+    duration integer,
+    samplerate integer,
+    channels integer,
+    bpm float,
+    beats BLOB,
+    beats_version TEXT,
+    key_id INTEGER DEFAULT 0,
+    rating integer DEFAULT 0,
+    color INTEGER,
+    location integer REFERENCES track_locations(location),
+    mixxx_deleted integer
+);
+CREATE TABLE cues (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    track_id integer NOT NULL REFERENCES library(id),
+    type integer DEFAULT 0 NOT NULL,
+    position integer DEFAULT -1 NOT NULL,
+    length integer DEFAULT 0 NOT NULL,
+    hotcue integer DEFAULT -1 NOT NULL,
+    label text DEFAULT '' NOT NULL,
+    color INTEGER DEFAULT 4294901760 NOT NULL
+);
+CREATE TABLE Playlists (
+    id INTEGER PRIMARY KEY,
+    name varchar(48),
+    position INTEGER,
+    hidden INTEGER DEFAULT 0 NOT NULL,
+    date_created datetime,
+    date_modified datetime,
+    locked integer DEFAULT 0
+);
+CREATE TABLE PlaylistTracks (
+    id INTEGER PRIMARY KEY,
+    playlist_id INTEGER REFERENCES Playlists(id),
+    track_id INTEGER REFERENCES library(id),
+    position INTEGER,
+    pl_datetime_added
+);
+CREATE TABLE crates (
+    id integer PRIMARY KEY AUTOINCREMENT,
+    name varchar(48) UNIQUE NOT NULL,
+    count integer DEFAULT 0,
+    show integer DEFAULT 1,
+    locked integer DEFAULT 0,
+    autodj_source integer DEFAULT 0
+);
+CREATE TABLE crate_tracks (
+    crate_id integer NOT NULL REFERENCES crates(id),
+    track_id integer NOT NULL REFERENCES library(id),
+    UNIQUE (crate_id, track_id)
+);
+"""
+
+GENRES = ["House", "Techno", "Drum & Bass", "Disco", "Garage", "Ambient", "Hip Hop"]
+SAMPLE_RATES = [44100, 44100, 44100, 48000]
+# Mostly MP3s, whose offsets have to be read from the file
+FILE_TYPES = ["mp3"] * 6 + ["flac", "m4a", "wav"]
+HOTCUE_COLOURS = [0xC02626, 0xF8821A, 0xFAC313, 0x1FAD26, 0x00FFFF, 0x173BA2]
+
+# MPEG-1 layer III, 128kbps, 44.1kHz, joint stereo
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x44])
+MP3_FRAME_LENGTH = 417
+# Where the Xing/Info header sits in a stereo MPEG-1 frame
+MP3_XING_POSITION = 36
+MP3_LAME_POSITION = 156
+
+
+def create_mp3_frame(rnd: random.Random) -> bytes:
+    # A silent first frame with a mix of the Xing/LAME layouts the offset probe tells apart
+    frame = bytearray(MP3_FRAME_HEADER + bytes(MP3_FRAME_LENGTH - 4))
+    if rnd.random() < 0.8:
+        frame[MP3_XING_POSITION : MP3_XING_POSITION + 8] = b"Info\x00\x00\x00\x00"
+        if rnd.random() < 0.9:
+            frame[MP3_LAME_POSITION : MP3_LAME_POSITION + 9] = b"LAME3.100"
+            music_crc = rnd.randrange(1, 0xFFFF) if rnd.random() < 0.9 else 0
+            frame[MP3_LAME_POSITION + 32 : MP3_LAME_POSITION + 34] = music_crc.to_bytes(
+                2, "big"
+            )
+    return bytes(frame)
+
+
+def create_id3v2_tag(rnd: random.Random) -> bytes:
+    tag_size = rnd.choice([0, 512, 4096])
+    if not tag_size:
+        return b""
+    syncsafe_size = bytes((tag_size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe_size + bytes(tag_size)
+
+
+def create_audio_file(track_path: Path, file_type: str, rnd: random.Random) -> None:
+    if file_type == "mp3":
+        track_path.write_bytes(
+            create_id3v2_tag(rnd) + create_mp3_frame(rnd) + bytes(MP3_FRAME_LENGTH)
+        )
+    else:
+        track_path.write_bytes(bytes(1024))
+
+
+def create_beat_grid(bpm: float, samplerate: int, rnd: random.Random) -> bytes:
+    beat_grid = BeatGrid()
+    beat_grid.bpm.bpm = bpm
+    beat_grid.first_beat.frame_position = rnd.randrange(0, samplerate)
+    return beat_grid.SerializeToString()
+
+
+def create_beat_map(
+    bpm: float, samplerate: int, duration: int, rnd: random.Random
+) -> bytes:
+    beat_map = BeatMap()
+    frame_position = float(rnd.randrange(0, samplerate))
+    beat_length = 60 * samplerate / bpm
+    # A few tracks drift or change tempo partway through
+    tempo_change_at = rnd.randrange(32, 512) if rnd.random() < 0.3 else None
+    source = rnd.choice([Source.ANALYZER, Source.ANALYZER, Source.USER])
+    beat_index = 0
+    while frame_position < duration * samplerate:
+        beat = beat_map.beat.add()
+        beat.frame_position = round(frame_position)
+        beat.source = source
+        if beat_index == tempo_change_at:
+            beat_length *= rnd.uniform(0.95, 1.05)
+        frame_position += beat_length
+        beat_index += 1
+    return beat_map.SerializeToString()
+
+
+def create_mixxx_db(
+    db_location: Path,
+    music_dir: Path,
+    track_count: int,
+    playlist_count: int,
+    crate_count: int,
+    tracks_per_collection: int,
+    seed: int = 0,
+) -> None:
+    rnd = random.Random(seed)
+    db_location.parent.mkdir(parents=True, exist_ok=True)
+    db_location.unlink(missing_ok=True)
+    music_dir.mkdir(parents=True, exist_ok=True)
+    # Mixxx stores absolute locations, the caches key on them too
+    music_dir = music_dir.resolve()
+    connection = sqlite3.connect(db_location)
+    connection.executescript(MIXXX_SCHEMA)
+
+    tracks = []
+    locations = []
+    cues = []
+    for track_id in range(1, track_count + 1):
+        file_type = rnd.choice(FILE_TYPES)
+        track_path = (
+            music_dir / f"Artist {track_id % 997} - Title {track_id}.{file_type}"
+        )
+        create_audio_file(track_path, file_type, rnd)
+        samplerate = rnd.choice(SAMPLE_RATES)
+        duration = rnd.randrange(150, 480)
+        bpm = round(rnd.uniform(85, 175), 2)
+        # Mixxx 2.1+ writes beat maps, older libraries still hold beat grids
+        if rnd.random() < 0.5:
+            beats = create_beat_map(bpm, samplerate, duration, rnd)
+            beats_version = "BeatMap-1.0"
+        else:
+            beats = create_beat_grid(bpm, samplerate, rnd)
+            beats_version = "BeatGrid-2.0"
+
+        locations.append(
+            (
+                track_id,
+                str(track_path),
+                track_path.name,
+                str(music_dir),
+                track_path.stat().st_size,
+            )
+        )
+        tracks.append(
+            (
+                track_id,
+                f"Artist {track_id % 997}",
+                f"Title {track_id}",
+                f"Album {track_id % 331}",
+                rnd.choice(GENRES),
+                duration,
+                samplerate,
+                2,
+                bpm,
+                beats,
+                beats_version,
+                rnd.randrange(0, 25),
+                rnd.randrange(0, 6),
+                rnd.choice(HOTCUE_COLOURS),
+                track_id,
+            )
+        )
+        # The main cue, which isn't exported, followed by a handful of hotcues
+        cues.append((track_id, 2, rnd.randrange(0, samplerate * 2), -1, 0))
+        for hotcue in range(rnd.randrange(0, 9)):
+            cues.append(
+                (
+                    track_id,
+                    1,
+                    rnd.randrange(0, duration * samplerate * 2),
+                    hotcue,
+                    rnd.choice(HOTCUE_COLOURS),
+                )
+            )
+
+    connection.executemany(
+        "INSERT INTO track_locations (id, location, filename, directory, filesize, fs_deleted, needs_verification) VALUES (?, ?, ?, ?, ?, 0, 0)",
+        locations,
+    )
+    connection.executemany(
+        "INSERT INTO library (id, artist, title, album, genre, duration, samplerate, channels, bpm, beats, beats_version, key_id, rating, color, location, mixxx_deleted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)",
+        tracks,
+    )
+    connection.executemany(
+        "INSERT INTO cues (track_id, type, position, hotcue, color) VALUES (?, ?, ?, ?, ?)",
+        cues,
+    )
+
+    track_ids = range(1, track_count + 1)
+    collection_size = min(tracks_per_collection, track_count)
+    for playlist_id in range(1, playlist_count + 1):
+        connection.execute(
+            "INSERT INTO Playlists (id, name, position, hidden) VALUES (?, ?, ?, 0)",
+            (playlist_id, f"Playlist {playlist_id}", playlist_id),
+        )
+        connection.executemany(
+            "INSERT INTO PlaylistTracks (playlist_id, track_id, position) VALUES (?, ?, ?)",
+            (
+                (playlist_id, track_id, position)
+                for position, track_id in enumerate(
+                    rnd.sample(track_ids, collection_size)
+                )
+            ),
+        )
+    for crate_id in range(1, crate_count + 1):
+        connection.execute(
+            "INSERT INTO crates (id, name) VALUES (?, ?)",
+            (crate_id, f"Crate {crate_id}"),
+        )
+        connection.executemany(
+            "INSERT INTO crate_tracks (crate_id, track_id) VALUES (?, ?)",
+            (
+                (crate_id, track_id)
+                for track_id in rnd.sample(track_ids, collection_size)
+            ),
+        )
+    connection.commit()
+    connection.close()
+
+
+arg_parser = argparse.ArgumentParser(
+    description="Generate a synthetic Mixxx library to benchmark exports against."
+)
+arg_parser.add_argument("db_location", type=Path, help="Where to write mixxxdb.sqlite.")
+arg_parser.add_argument(
+    "music_dir", type=Path, help="Folder to write the dummy audio files to."
+)
+arg_parser.add_argument(
+    "--tracks", type=int, default=1000, help="Number of tracks. Defaults to 1000."
+)
+arg_parser.add_argument(
+    "--playlists", type=int, default=50, help="Number of playlists. Defaults to 50."
+)
+arg_parser.add_argument(
+    "--crates", type=int, default=20, help="Number of crates. Defaults to 20."
+)
+arg_parser.add_argument(
+    "--tracks-per-collection",
+    type=int,
+    default=100,
+    help="Tracks in each playlist and crate. Defaults to 100.",
+)
+arg_parser.add_argument(
+    "--seed", type=int, default=0, help="Random seed, for repeatable libraries."
+)
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+    create_mixxx_db(
+        args.db_location,
+        args.music_dir,
+        args.tracks,
+        args.playlists,
+        args.crates,
+        args.tracks_per_collection,
+        args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import argparse
+from pathlib import Path
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# Modules the CLI shouldn't load until an export actually needs them
+HEAVY_MODULES = [
+    "numpy",
+    "lxml",
+    "eyed3",
+    "google.protobuf",
+    "tqdm",
+    "multiprocessing.pool",
+]
+
+WORKER_START_SCRIPT = """
+import multiprocessing, sys
+from time import perf_counter
+if sys.argv[1] != "default":
+    multiprocessing.set_start_method(sys.argv[1])
+start = perf_counter()
+from handlers.export import mixxx_cuepos_to_ms
+from handlers.workers import ExportStats, create_worker_pool
+with create_worker_pool(ExportStats()) as worker_pool:
+    # Unpickling the task makes each worker import the export handlers, as a real export does
+    worker_pool.process_pool.starmap(mixxx_cuepos_to_ms, [(0, 44100, 2)] * 64, chunksize=1)
+    print(perf_counter() - start)
+"""
+
+arg_parser = argparse.ArgumentParser(
+    description="Time CLI start-up, importing the export handlers and starting the worker pool."
+)
+arg_parser.add_argument(
+    "--repeat",
+    type=int,
+    default=10,
+    help="Runs of each measurement, the median is reported.",
+)
+arg_parser.add_argument(
+    "--cli-budget-ms",
+    type=float,
+    default=150,
+    help="Fail if main.py --help takes longer than this. Defaults to 150ms.",
+)
+arg_parser.add_argument(
+    "--worker-budget-ms",
+    type=float,
+    default=1500,
+    help="Fail if starting the worker pool and getting results back takes longer than this. Defaults to 1500ms.",
+)
+arg_parser.add_argument(
+    "--start-method",
+    choices=["default", "fork", "forkserver", "spawn"],
+    default="default",
+    help="How the worker pool starts its processes. Defaults to the platform's own.",
+)
+
+
+def time_command(command: list[str], repeat: int) -> float:
+    run_secs = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run(command, cwd=REPO_DIR, check=True, capture_output=True)
+        run_secs.append(perf_counter() - start)
+    return statistics.median(run_secs)
+
+
+def time_worker_start(start_method: str, repeat: int) -> float:
+    return statistics.median(
+        float(
+            subprocess.run(
+                [sys.executable, "-c", WORKER_START_SCRIPT, start_method],
+                cwd=REPO_DIR,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeat)
+    )
+
+
+def get_cli_modules() -> list[str]:
+    loaded_modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; sys.argv = ['main.py', '--help']\n"
+            "try:\n    import runpy; runpy.run_path('main.py', run_name='__main__')\n"
+            "except SystemExit:\n    print('\\n'.join(sys.modules))",
+        ],
+        cwd=REPO_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.splitlines()
+    return [module for module in HEAVY_MODULES if module in loaded_modules]
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+
+    python_sec = time_command([sys.executable, "-c", "pass"], args.repeat)
+    cli_sec = time_command([sys.executable, "main.py", "--help"], args.repeat)
+    import_sec = time_command(
+        [sys.executable, "-c", "import handlers.export"], args.repeat
+    )
+    worker_sec = time_worker_start(args.start_method, args.repeat)
+    cli_modules = get_cli_modules()
+
+    print(f"{'python start-up':<32}{python_sec * 1000:>8.1f}ms")
+    print(f"{'main.py --help':<32}{cli_sec * 1000:>8.1f}ms")
+    print(f"{'import handlers.export':<32}{import_sec * 1000:>8.1f}ms")
+    print(f"{'worker pool to first results':<32}{worker_sec * 1000:>8.1f}ms")
+
+    over_budget = False
+    if cli_sec * 1000 > args.cli_budget_ms:
+        print(f"main.py --help is over its {args.cli_budget_ms:.0f}ms budget.")
+        over_budget = True
+    if worker_sec * 1000 > args.worker_budget_ms:
+        print(
+            f"Starting the worker pool is over its {args.worker_budget_ms:.0f}ms budget."
+        )
+        over_budget = True
+    if cli_modules:
+        print(f"main.py --help loaded {', '.join(cli_modules)}.")
+        over_budget = True
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
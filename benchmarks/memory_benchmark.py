@@ -0,0 +1,121 @@
+import argparse
+import gc
+import json
+from pathlib import Path
+import pickle
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.export_benchmark import load_tracks
+from benchmarks.generate_mixxx_db import create_mixxx_db
+from handlers import sql as sql_handlers
+from handlers.export import get_exported_track
+from models import KeyType
+
+METRICS = {
+    "built_bytes": "memory per built track",
+    "unpickled_bytes": "memory per unpickled track",
+    "pickled_bytes": "pickled size per track",
+    "unpickle_us": "unpickle time per track",
+}
+
+arg_parser = argparse.ArgumentParser(
+    description="Measure the memory and pickling cost of each exported track."
+)
+arg_parser.add_argument(
+    "--tracks",
+    type=int,
+    default=10000,
+    help="Size of the synthetic library. Defaults to 10000.",
+)
+arg_parser.add_argument(
+    "--save",
+    type=Path,
+    help="Write the results to this JSON file, e.g. a new baseline.",
+)
+arg_parser.add_argument(
+    "--compare", type=Path, help="A results JSON file to compare against."
+)
+
+
+def get_retained_bytes(build) -> tuple[list, int]:
+    # Only what's still held once the objects are built, not what was freed along the way
+    gc.collect()
+    tracemalloc.start()
+    start_bytes, _ = tracemalloc.get_traced_memory()
+    values = build()
+    gc.collect()
+    end_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return values, end_bytes - start_bytes
+
+
+def benchmark(track_count: int, work_dir: Path) -> dict[str, float]:
+    db_location = work_dir / "mixxxdb.sqlite"
+    create_mixxx_db(
+        db_location,
+        work_dir / "music",
+        track_count,
+        max(1, track_count // 50),
+        max(1, track_count // 200),
+        200,
+    )
+    sql_handlers.set_db_location(str(db_location))
+    track_tasks = load_tracks()
+    # The first track imports the beat grid decoder, numpy and protobuf, which aren't a per track cost
+    get_exported_track(track_tasks[0], KeyType.LANCELOT)
+
+    exported_tracks, built_bytes = get_retained_bytes(
+        lambda: [
+            get_exported_track(track_task, KeyType.LANCELOT)
+            for track_task in track_tasks
+        ]
+    )
+    # Each track comes back from the pool workers, and out of the export cache, pickled on its own
+    pickled_tracks = [
+        pickle.dumps(exported_track) for exported_track in exported_tracks
+    ]
+    del exported_tracks
+    _, unpickled_bytes = get_retained_bytes(
+        lambda: [pickle.loads(pickled_track) for pickled_track in pickled_tracks]
+    )
+    # Timed separately, tracemalloc slows down every allocation
+    start = perf_counter()
+    unpickled_tracks = [pickle.loads(pickled_track) for pickled_track in pickled_tracks]
+    unpickle_sec = perf_counter() - start
+    del unpickled_tracks
+
+    sql_handlers.get_connection().close()
+    return {
+        "built_bytes": built_bytes / len(track_tasks),
+        "unpickled_bytes": unpickled_bytes / len(track_tasks),
+        "pickled_bytes": sum(map(len, pickled_tracks)) / len(track_tasks),
+        "unpickle_us": unpickle_sec * 1_000_000 / len(track_tasks),
+    }
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = benchmark(args.tracks, Path(work_dir))
+
+    for metric, description in METRICS.items():
+        unit = "us" if metric.endswith("_us") else "B"
+        row = f"{description:<30}{results[metric]:>10.1f}{unit}"
+        if baseline:
+            row += f" ({results[metric] / baseline[metric]:.2f}x)"
+        print(row)
+    if baseline:
+        print("\nIn brackets: relative to the baseline, lower is better.")
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
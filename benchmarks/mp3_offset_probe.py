@@ -0,0 +1,83 @@
+import argparse
+import logging
+from pathlib import Path
+import sys
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import eyed3  # type: ignore
+
+from offset_handlers import get_case_mp3, probe_case_mp3
+
+arg_parser = argparse.ArgumentParser(
+    description="Compare the header-only MP3 offset probe against a full eyed3 parse."
+)
+arg_parser.add_argument(
+    "paths", nargs="+", type=Path, help="MP3 files or directories to search for them."
+)
+arg_parser.add_argument(
+    "--repeat", type=int, default=3, help="Times to probe each file. Defaults to 3."
+)
+
+
+def get_mp3_paths(paths: list[Path]) -> list[Path]:
+    mp3_paths = []
+    for path in paths:
+        if path.is_dir():
+            mp3_paths.extend(sorted(path.rglob("*.mp3")))
+        else:
+            mp3_paths.append(path)
+    return mp3_paths
+
+
+def time_probe(mp3_paths: list[Path], probe, repeat: int) -> tuple[float, dict]:
+    cases = {}
+    start = perf_counter()
+    for _ in range(repeat):
+        for mp3_path in mp3_paths:
+            try:
+                cases[mp3_path] = probe(mp3_path)
+            except Exception as ex:
+                cases[mp3_path] = f"error: {ex}"
+    return perf_counter() - start, cases
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+    # eyed3 warns about every file it can't find a frame in
+    logging.getLogger("eyed3").setLevel(logging.CRITICAL)
+    mp3_paths = get_mp3_paths(args.paths)
+    if not mp3_paths:
+        raise Exception("No MP3 files found.")
+
+    eyed3_sec, eyed3_cases = time_probe(
+        mp3_paths, lambda path: get_case_mp3(eyed3.load(path)), args.repeat
+    )
+    header_sec, header_cases = time_probe(mp3_paths, probe_case_mp3, args.repeat)
+
+    probes = len(mp3_paths) * args.repeat
+    print(f"Probed {len(mp3_paths)} MP3s {args.repeat} times each.")
+    print(f"eyed3:       {eyed3_sec:.3f}s ({eyed3_sec / probes * 1000:.3f}ms per file)")
+    print(
+        f"header only: {header_sec:.3f}s ({header_sec / probes * 1000:.3f}ms per file)"
+    )
+    print(f"Speed-up:    {eyed3_sec / header_sec:.1f}x")
+
+    fallbacks = [path for path, case in header_cases.items() if case is None]
+    mismatches = [
+        path
+        for path, case in header_cases.items()
+        if case is not None and case != eyed3_cases[path]
+    ]
+    print(
+        f"{len(fallbacks)} files would fall back to eyed3, {len(mismatches)} disagree."
+    )
+    for path in mismatches:
+        print(
+            f"Mismatch for {path}: eyed3 {eyed3_cases[path]}, header {header_cases[path]}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+from contextlib import chdir, redirect_stderr
+from functools import partial
+import io
+import json
+from multiprocessing import Manager
+from multiprocessing.pool import Pool
+from pathlib import Path
+import sys
+import tempfile
+from threading import Semaphore
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.export_benchmark import load_tracks
+from benchmarks.generate_mixxx_db import create_mixxx_db
+from handlers import sql as sql_handlers
+from handlers.export import (
+    OFFSET_CACHE_LOCATION,
+    TrackTask,
+    get_data_for_tracks,
+    get_exported_track,
+    probe_exported_track_offset,
+)
+from handlers.offset_cache import ProbedOffset
+from handlers.workers import ExportStats, create_worker_pool
+from models import ExportedTrack, ExportOptions, KeyType
+
+MODES = {
+    "in_process": "no workers",
+    "manager": "Manager proxies per task",
+    "pipeline": "export pipeline",
+}
+
+arg_parser = argparse.ArgumentParser(
+    description="Measure what handing each track to the worker processes costs on a metadata only export."
+)
+arg_parser.add_argument(
+    "--tracks",
+    type=int,
+    default=10000,
+    help="Size of the synthetic library. Defaults to 10000.",
+)
+arg_parser.add_argument(
+    "--save",
+    type=Path,
+    help="Write the results to this JSON file, e.g. a new baseline.",
+)
+arg_parser.add_argument(
+    "--compare", type=Path, help="A results JSON file to compare against."
+)
+
+
+def export_track(
+    track_task: TrackTask, offset_cache_location: str | None
+) -> tuple[ExportedTrack, ProbedOffset]:
+    exported_track = get_exported_track(track_task, KeyType.LANCELOT)
+    return probe_exported_track_offset(exported_track, offset_cache_location, "MAD")[:2]
+
+
+def export_track_with_manager(
+    track_task: TrackTask, export_semaphore: Semaphore, track_collection: dict
+) -> tuple[ExportedTrack, ProbedOffset]:
+    # How tracks were handed out before the pipeline, both proxies are pickled with every chunk
+    if track_task.track_id in track_collection:
+        return track_collection[track_task.track_id]
+    with export_semaphore:
+        return export_track(track_task, None)
+
+
+def run_in_process(track_tasks: list[TrackTask]) -> None:
+    for track_task in track_tasks:
+        export_track(track_task, None)
+
+
+def run_manager(track_tasks: list[TrackTask]) -> float:
+    with Manager() as manager, Pool() as pool:
+        export_semaphore = manager.Semaphore(4)
+        track_collection = manager.dict()
+        start = perf_counter()
+        list(
+            pool.imap(
+                partial(
+                    export_track_with_manager,
+                    export_semaphore=export_semaphore,
+                    track_collection=track_collection,
+                ),
+                track_tasks,
+                chunksize=2,
+            )
+        )
+        return perf_counter() - start
+
+
+def run_pipeline(track_tasks: list[TrackTask]) -> float:
+    options = ExportOptions(export_all=True)
+    with create_worker_pool(ExportStats()) as worker_pool:
+        start = perf_counter()
+        with redirect_stderr(io.StringIO()):
+            list(get_data_for_tracks(track_tasks, worker_pool, options))
+        return perf_counter() - start
+
+
+def benchmark(track_count: int, work_dir: Path) -> dict[str, float]:
+    db_location = work_dir / "mixxxdb.sqlite"
+    create_mixxx_db(
+        db_location,
+        work_dir / "music",
+        track_count,
+        max(1, track_count // 50),
+        max(1, track_count // 200),
+        200,
+    )
+    sql_handlers.set_db_location(str(db_location))
+    track_tasks = load_tracks()
+
+    start = perf_counter()
+    run_in_process(track_tasks)
+    in_process_sec = perf_counter() - start
+    manager_sec = run_manager(track_tasks)
+    # A fresh offset cache, so every track is probed and its offset written as on a first export
+    with chdir(work_dir):
+        Path(OFFSET_CACHE_LOCATION).unlink(missing_ok=True)
+        pipeline_sec = run_pipeline(track_tasks)
+
+    sql_handlers.get_connection().close()
+    return {
+        mode: run_sec * 1_000_000 / len(track_tasks)
+        for mode, run_sec in [
+            ("in_process", in_process_sec),
+            ("manager", manager_sec),
+            ("pipeline", pipeline_sec),
+        ]
+    }
+
+
+def main() -> None:
+    args = arg_parser.parse_args()
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = benchmark(args.tracks, Path(work_dir))
+
+    for mode, description in MODES.items():
+        row = f"{description:<28}{results[mode]:>10.1f}us per track"
+        if mode != "in_process":
+            row += f", {results[mode] - results['in_process']:>8.1f}us overhead"
+        if baseline:
+            row += f" ({results[mode] / baseline[mode]:.2f}x)"
+        print(row)
+    if baseline:
+        print("\nIn brackets: relative to the baseline, lower is better.")
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+from collections.abc import Iterator
+from pathlib import Path
+
+from models import ExportedTrack, KeyType, LinkMode
+
+# Bump whenever ExportedTrack or the way it's built changes, stale entries are then dropped
+CACHE_VERSION = 5
+
+CACHE_TABLE_QUERY = """
+                CREATE TABLE IF NOT EXISTS exported_tracks (
+                    id INTEGER PRIMARY KEY,
+                    fingerprint TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    track BLOB NOT NULL
+                )
+                """
+
+_cache_location: str | None = None
+
+
+def get_cache_location(xml_location: str) -> str:
+    return str(Path(xml_location).with_suffix(".cache.sqlite"))
+
+
+def set_cache_location(cache_location: str | None) -> None:
+    global _cache_location
+    _cache_location = cache_location
+
+
+@functools.cache
+def get_cache_connection() -> sqlite3.Connection:
+    connection = sqlite3.connect(_cache_location)
+    if connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+        connection.execute("DROP TABLE IF EXISTS exported_tracks")
+        connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+    connection.execute(CACHE_TABLE_QUERY)
+    connection.commit()
+    return connection
+
+
+def is_cache_enabled() -> bool:
+    return bool(_cache_location)
+
+
+def get_file_identity(track_location: str) -> tuple[int, int] | None:
+    try:
+        stat = os.stat(track_location)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_track_fingerprint(
+    track_info: sqlite3.Row,
+    cue_points: list[sqlite3.Row],
+    out_dir: str | None,
+    out_format: str | None,
+    link_mode: LinkMode,
+    key_type: KeyType,
+    measure_offsets: bool,
+) -> str:
+    track_location = track_info[-1]
+    return hashlib.blake2b(
+        repr(
+            (
+                tuple(track_info),
+                [tuple(cue_point) for cue_point in cue_points],
+                get_file_identity(track_location),
+                out_dir,
+                out_format,
+                link_mode,
+                str(key_type),
+                measure_offsets,
+            )
+        ).encode(),
+        digest_size=16,
+    ).hexdigest()
+
+
+def read_cache(query: str, params: dict) -> list[tuple]:
+    # Read only, as a --plan mustn't create or change the cache
+    if not is_cache_enabled() or not os.path.exists(_cache_location):
+        return []
+    connection = sqlite3.connect(
+        f"{Path(_cache_location).resolve().as_uri()}?mode=ro", uri=True
+    )
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+            return []
+        return connection.execute(query, params).fetchall()
+    except sqlite3.OperationalError:
+        # A cache file without the table yet
+        return []
+    finally:
+        connection.close()
+
+
+def get_cached_track_ids(fingerprints: dict[int, str]) -> set[int]:
+    return {
+        track_id
+        for track_id, fingerprint, location in read_cache(
+            "SELECT id, fingerprint, location FROM exported_tracks WHERE id IN (SELECT value FROM json_each(:ids))",
+            {"ids": json.dumps(list(fingerprints))},
+        )
+        # Copied or transcoded files may have been cleared out since the last run
+        if fingerprints[track_id] == fingerprint and os.path.exists(location)
+    }
+
+
+def get_cached_tracks(track_ids: list[int]) -> Iterator[ExportedTrack]:
+    if not track_ids:
+        return
+    cursor = get_cache_connection().cursor()
+    for track_id in track_ids:
+        (track,) = cursor.execute(
+            "SELECT track FROM exported_tracks WHERE id = :id", {"id": track_id}
+        ).fetchone()
+        yield pickle.loads(track)
+
+
+def cache_track(track_id: int, fingerprint: str, exported_track: ExportedTrack) -> None:
+    if not is_cache_enabled():
+        return
+    get_cache_connection().execute(
+        "INSERT OR REPLACE INTO exported_tracks (id, fingerprint, location, track) VALUES (?, ?, ?, ?)",
+        (
+            track_id,
+            fingerprint,
+            exported_track.track_context.location,
+            pickle.dumps(exported_track),
+        ),
+    )
+
+
+def commit_cache() -> None:
+    if is_cache_enabled():
+        get_cache_connection().commit()
@@ -0,0 +1,160 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import os
+from threading import Condition, Event, Thread
+from time import perf_counter
+
+CPU_COUNT = os.cpu_count() or 1
+# ffmpeg encodes a track on about one core, so transcodes start at half the cores and may grow to all of them
+TRANSCODE_START_CONCURRENCY = max(CPU_COUNT // 2, 1)
+TRANSCODE_MAX_CONCURRENCY = CPU_COUNT
+# Copies wait on the disk rather than the CPU, a slow USB stick wants few at once, a fast SSD many
+COPY_START_CONCURRENCY = 4
+COPY_MAX_CONCURRENCY = 32
+
+TUNE_INTERVAL_SEC = 2.0
+# Changes in throughput smaller than this are treated as noise
+THROUGHPUT_TOLERANCE = 0.05
+# Above this share of every core in use, adding transcodes only slows each one down
+CPU_BUSY = 0.9
+
+
+@dataclass
+class AdaptiveLimit:
+    # A semaphore whose count can change while it's in use, so a stage can run more or fewer items at once
+    name: str
+    limit: int
+    min_limit: int = 1
+    max_limit: int = 1
+    is_fixed: bool = False
+    # Whether the limit is held back when the CPU is busy, for work that's CPU bound
+    watch_cpu: bool = False
+    in_flight: int = 0
+    completed_bytes: int = 0
+    peak_limit: int = 0
+    condition: Condition = field(default_factory=Condition)
+
+    def acquire(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def add_completed(self, work_bytes: int) -> None:
+        with self.condition:
+            self.completed_bytes += work_bytes
+
+    def set_limit(self, limit: int) -> None:
+        with self.condition:
+            self.limit = min(max(limit, self.min_limit), self.max_limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+            self.condition.notify_all()
+
+
+def create_limit(
+    name: str,
+    override: int | None,
+    start_limit: int,
+    max_limit: int,
+    watch_cpu: bool = False,
+) -> AdaptiveLimit:
+    if override:
+        return AdaptiveLimit(
+            name, override, override, override, is_fixed=True, peak_limit=override
+        )
+    return AdaptiveLimit(
+        name,
+        start_limit,
+        max_limit=max_limit,
+        watch_cpu=watch_cpu,
+        peak_limit=start_limit,
+    )
+
+
+def get_transcode_limit(override: int | None) -> AdaptiveLimit:
+    return create_limit(
+        "transcode",
+        override,
+        TRANSCODE_START_CONCURRENCY,
+        TRANSCODE_MAX_CONCURRENCY,
+        watch_cpu=True,
+    )
+
+
+def get_copy_limit(override: int | None) -> AdaptiveLimit:
+    return create_limit("copy", override, COPY_START_CONCURRENCY, COPY_MAX_CONCURRENCY)
+
+
+def get_cpu_sec() -> float:
+    # Includes ffmpeg processes once they've exited, which is where transcodes spend their time
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+@dataclass
+class _TuneState:
+    throughput: float = 0.0
+    step: int = 1
+    completed_bytes: int = 0
+
+
+def tune_limit(
+    limit: AdaptiveLimit, state: _TuneState, interval_sec: float, cpu_share: float
+) -> None:
+    with limit.condition:
+        completed_bytes = limit.completed_bytes
+        # Nothing to learn while the stage is waiting on earlier stages rather than its own limit
+        is_saturated = limit.in_flight >= limit.limit
+    throughput = (completed_bytes - state.completed_bytes) / interval_sec
+    state.completed_bytes = completed_bytes
+    if not is_saturated or not throughput:
+        return
+
+    # Hill climbs towards the limit with the best throughput, turning back whenever a step made it worse
+    if throughput < state.throughput * (1 - THROUGHPUT_TOLERANCE):
+        state.step = -state.step
+    elif throughput < state.throughput * (1 + THROUGHPUT_TOLERANCE):
+        # No better for the extra work in flight, so fewer at once does as well and thrashes less
+        state.step = -1
+    step = state.step
+    if limit.watch_cpu and cpu_share > CPU_BUSY:
+        step = min(step, 0)
+    state.throughput = throughput
+    limit.set_limit(limit.limit + step)
+
+
+def run_tuner(limits: list[AdaptiveLimit], stop: Event) -> None:
+    states = {limit.name: _TuneState() for limit in limits}
+    last_sec = perf_counter()
+    last_cpu_sec = get_cpu_sec()
+    while not stop.wait(TUNE_INTERVAL_SEC):
+        now_sec = perf_counter()
+        cpu_sec = get_cpu_sec()
+        interval_sec = now_sec - last_sec
+        cpu_share = (cpu_sec - last_cpu_sec) / (interval_sec * CPU_COUNT)
+        last_sec, last_cpu_sec = now_sec, cpu_sec
+        for limit in limits:
+            tune_limit(limit, states[limit.name], interval_sec, cpu_share)
+
+
+@contextmanager
+def tune_concurrency(limits: list[AdaptiveLimit]) -> Iterator[None]:
+    adaptive_limits = [limit for limit in limits if not limit.is_fixed]
+    if not adaptive_limits:
+        yield
+        return
+    stop = Event()
+    tuner = Thread(
+        target=run_tuner, args=(adaptive_limits, stop), name="tuner", daemon=True
+    )
+    tuner.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        tuner.join()
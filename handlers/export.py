@@ -1,40 +1,82 @@
+from collections.abc import Iterator
+from contextlib import nullcontext
+from dataclasses import dataclass
 from functools import partial
-from multiprocessing import Manager
-from multiprocessing.pool import Pool
-from multiprocessing.synchronize import Semaphore
-from lxml import etree
+from itertools import chain
+import os
+from pathlib import Path
+import sqlite3
+from time import perf_counter
+from handlers import cache as cache_handlers
+from handlers import offset_cache as offset_cache_handlers
+from handlers.offset_cache import OffsetMethod, OffsetToCache, ProbedOffset
 from handlers import sql as sql_handlers
-from handlers.transcode import EXPORT_SEMAPHORE_COUNT, change_track_location
+from handlers.transcode import change_track_location
+from handlers.concurrency import (
+    AdaptiveLimit,
+    get_copy_limit,
+    get_transcode_limit,
+    tune_concurrency,
+)
+from handlers.pipeline import Stage, run_pipeline
+from handlers import plan as plan_handlers
+from handlers.selection import select_collections
+from handlers import profiling as profiling_handlers
+from handlers.profiling import profile_span, profile_waits
+from handlers.workers import (
+    IO_THREADS,
+    METADATA_CONCURRENCY,
+    OFFSET_CONCURRENCY,
+    ExportStats,
+    WorkerPool,
+    create_worker_pool,
+    print_export_stats,
+)
 from models import (
     RATING_MAP,
     BeatGridInfo,
-    CollectionType,
-    CueColour,
     CuePoint,
     ExportedTrack,
+    ExportOptions,
     KeyType,
     TrackContext,
 )
 from tqdm import tqdm
 from offset_handlers import flush_offset_errors
 from rekordbox_gen import (
-    TRACK_COLLECTION,
-    encode_xml_element,
     format_track_id,
-    generate_xml,
+    read_xml,
+    update_xml,
+    write_xml,
+    write_xml_element,
 )
 
+REKORDBOX_XML_LOCATION = "rekordbox.xml"
+TEMP_XML_LOCATION = f"{REKORDBOX_XML_LOCATION}.tmp"
+OFFSET_CACHE_LOCATION = offset_cache_handlers.get_offset_cache_location(
+    REKORDBOX_XML_LOCATION
+)
+PROFILE_TRACE_LOCATION = "rekordbox.trace.json"
+
+# What the last export in this process was built from, so --watch can skip changes that don't affect it
+_last_export_inputs: tuple | None = None
+
 
 def mixxx_cuepos_to_ms(cuepos: int, samplerate: int, channels: int):
     return int((cuepos * 1000.0) / (samplerate * channels))
 
 
+@dataclass
+class TrackTask:
+    track_id: int
+    track_info: sqlite3.Row
+    cue_points: list[sqlite3.Row]
+
+
 def get_track_info(
-    track_id: str,
-    out_dir: str | None,
-    out_format: str | None,
+    track_id: int,
+    track_info: sqlite3.Row,
     key_type: KeyType,
-    export_semaphore: Semaphore,
 ) -> tuple[TrackContext, BeatGridInfo | None]:
     (
         samplerate,
@@ -51,12 +93,7 @@ def get_track_info(
         rating,
         colour,
         track_location,
-    ) = sql_handlers.get_track_info(track_id)
-
-    if out_dir or out_format:
-        track_location = change_track_location(
-            track_location, out_dir, out_format, export_semaphore
-        )
+    ) = track_info
 
     return TrackContext(
         id=track_id,
@@ -76,150 +113,384 @@ def get_track_info(
 
 
 def get_cue_points(
-    track_id: str,
+    cue_points: list[sqlite3.Row],
     samplerate: int,
     channels: int,
 ) -> list[CuePoint]:
     return [
         CuePoint(
-            1,
             cue_index,
             mixxx_cuepos_to_ms(
                 int(cue_position),
                 samplerate,
                 channels,
             ),
-            CueColour(hex(color)),
+            color,
         )
-        for (cue_index, cue_position, color) in sql_handlers.get_cue_points(track_id)
+        for (cue_index, cue_position, color) in cue_points
     ]
 
 
-def get_exported_track(
-    track_id: str,
-    out_dir: str | None,
-    out_format: str | None,
-    key_type: KeyType,
-    export_semaphore: Semaphore,
-    track_collection: dict,
-) -> ExportedTrack:
-    if track_id in track_collection:
-        return track_collection[track_id]
-
+def get_exported_track(track_task: TrackTask, key_type: KeyType) -> ExportedTrack:
     track_context, beat_grid = get_track_info(
-        track_id, out_dir, out_format, key_type, export_semaphore
+        track_task.track_id, track_task.track_info, key_type
     )
     return ExportedTrack(
-        id=format_track_id(track_id),
+        id=format_track_id(track_task.track_id),
         track_context=track_context,
         beat_grid=beat_grid,
         cue_points=get_cue_points(
-            track_id, track_context.samplerate, track_context.channels
+            track_task.cue_points, track_context.samplerate, track_context.channels
         ),
     )
 
 
-def init_track_worker(db_location: str) -> None:
-    sql_handlers.set_db_location(db_location)
+def relocate_exported_track(
+    exported_track: ExportedTrack, options: ExportOptions, limit: AdaptiveLimit
+) -> ExportedTrack:
+    exported_track.track_context.location, source_bytes = change_track_location(
+        exported_track.track_context.location,
+        options.out_dir,
+        options.out_format,
+        options.link_mode,
+    )
+    # Files already up to date count for nothing, the tuner would otherwise see them as very fast copies
+    limit.add_completed(source_bytes)
+    return exported_track
+
+
+def probe_exported_track_offset(
+    exported_track: ExportedTrack,
+    offset_cache_location: str | None,
+    offset_method: OffsetMethod,
+) -> tuple[ExportedTrack, ProbedOffset, OffsetToCache | None]:
+    track_location = exported_track.track_context.location
+    probed_offset, file_identity = offset_cache_handlers.get_offset(
+        track_location, offset_cache_location, offset_method
+    )
+    exported_track.set_offset_sec(probed_offset[0] / 1000.0)
+    # Errors and offsets to cache are handed back rather than recorded, as this runs in a worker process.
+    # They keep the probed location, a mirrored track is moved to the output directory afterwards.
+    return (
+        exported_track,
+        probed_offset,
+        (track_location, file_identity) if file_identity else None,
+    )
+
+
+def relocate_probed_track(
+    probed_track: tuple[ExportedTrack, ProbedOffset, OffsetToCache | None],
+    options: ExportOptions,
+    limit: AdaptiveLimit,
+) -> tuple[ExportedTrack, ProbedOffset, OffsetToCache | None]:
+    exported_track, probed_offset, offset_to_cache = probed_track
+    return (
+        relocate_exported_track(exported_track, options, limit),
+        probed_offset,
+        offset_to_cache,
+    )
+
+
+def get_offset_method(options: ExportOptions) -> OffsetMethod:
+    return "measured" if options.measure_offsets else "MAD"
+
+
+def get_export_stages(worker_pool: WorkerPool, options: ExportOptions) -> list[Stage]:
+    metadata_stage = Stage(
+        "metadata",
+        partial(get_exported_track, key_type=options.key_type),
+        worker_pool.process_pool,
+        METADATA_CONCURRENCY,
+        lambda track_task: track_task.track_id,
+    )
+    offsets_stage = Stage(
+        "offsets",
+        partial(
+            probe_exported_track_offset,
+            offset_cache_location=OFFSET_CACHE_LOCATION if options.use_cache else None,
+            offset_method=get_offset_method(options),
+        ),
+        worker_pool.process_pool,
+        OFFSET_CONCURRENCY,
+        lambda exported_track: exported_track.track_context.id,
+    )
+    if not options.out_dir:
+        return [metadata_stage, offsets_stage]
+
+    files_limit = (
+        get_transcode_limit(options.transcode_jobs)
+        if options.out_format
+        else get_copy_limit(options.copy_jobs)
+    )
+    if options.out_format:
+        # Offsets depend on the file Rekordbox will read, so they're probed after the transcode
+        return [
+            metadata_stage,
+            Stage(
+                "files",
+                # Runs on the io threads in this process, so it reports what it wrote straight to its limit
+                partial(relocate_exported_track, options=options, limit=files_limit),
+                worker_pool.io_pool,
+                files_limit,
+                lambda exported_track: exported_track.track_context.id,
+            ),
+            offsets_stage,
+        ]
+    # A copy or link has the same offset as its source, probed first so it's cached under the source,
+    # where --warm-offsets and exports without --out-dir find it
+    return [
+        metadata_stage,
+        offsets_stage,
+        Stage(
+            "files",
+            partial(relocate_probed_track, options=options, limit=files_limit),
+            worker_pool.io_pool,
+            files_limit,
+            lambda probed_track: probed_track[0].track_context.id,
+        ),
+    ]
 
 
 def get_data_for_tracks(
-    track_ids: list[str],
-    out_dir: str | None,
-    out_format: str | None,
-    key_type: KeyType,
-    db_location: str | None,
-) -> list[ExportedTrack]:
-    manager = Manager()
-    export_semaphore = manager.Semaphore(EXPORT_SEMAPHORE_COUNT)
-    track_collection = manager.dict()
-    track_collection.update(TRACK_COLLECTION)
-    with Pool(
-        # os.cpu_count() // (2 if out_format else 1),
-        initializer=init_track_worker,
-        initargs=(db_location,),
-    ) as pool:
-        return list(
-            tqdm(
-                pool.imap(
-                    partial(
-                        get_exported_track,
-                        out_dir=out_dir,
-                        out_format=out_format,
-                        key_type=key_type,
-                        export_semaphore=export_semaphore,
-                        track_collection=track_collection,
-                    ),
-                    track_ids,
-                    chunksize=1 if out_format else 2,
-                ),
-                unit="track",
-                total=len(track_ids),
-            )
+    track_tasks: list[TrackTask],
+    worker_pool: WorkerPool | None,
+    options: ExportOptions,
+) -> Iterator[ExportedTrack]:
+    if not track_tasks:
+        return
+    start = perf_counter()
+    stages = get_export_stages(worker_pool, options)
+    limits = [
+        stage.concurrency
+        for stage in stages
+        if isinstance(stage.concurrency, AdaptiveLimit)
+    ]
+    # Written by this process in one go, rather than each worker committing its own
+    probed_offsets: dict[str, ProbedOffset] = {}
+    file_identities: dict[str, tuple[int, int]] = {}
+    with tune_concurrency(limits):
+        for exported_track, probed_offset, offset_to_cache in tqdm(
+            run_pipeline(stages, track_tasks, profiling_handlers.get_profiler()),
+            unit="track",
+            total=len(track_tasks),
+        ):
+            if offset_error := probed_offset[1]:
+                worker_pool.stats.offset_errors[
+                    exported_track.track_context.location
+                ] = offset_error
+            if offset_to_cache:
+                probed_location, file_identity = offset_to_cache
+                probed_offsets[probed_location] = probed_offset
+                file_identities[probed_location] = file_identity
+            yield exported_track
+    if probed_offsets:
+        offset_cache_handlers.cache_offsets(
+            OFFSET_CACHE_LOCATION,
+            probed_offsets,
+            file_identities,
+            get_offset_method(options),
         )
+    for limit in limits:
+        worker_pool.stats.peak_concurrency[limit.name] = limit.peak_limit
+    worker_pool.stats.work_sec += perf_counter() - start
+    worker_pool.stats.processed_tracks += len(track_tasks)
 
 
-def append_collection_to_element(
-    collection_id: str,
-    collection_name: str,
-    xml_element: etree.Element,
-    export_all: bool,
-    collection_type: CollectionType,
-    out_dir: str | None,
-    out_format: str | None,
-    key_type: KeyType,
-    db_location: str | None,
-) -> etree.Element:
-    if (
-        not export_all
-        and input(f"Export {collection_name}? [y/n]").lower().strip() != "y"
-    ):
-        return xml_element
+def get_changed_tracks(
+    track_tasks: list[TrackTask],
+    fingerprints: dict[int, str],
+    worker_pool: WorkerPool | None,
+    options: ExportOptions,
+) -> Iterator[ExportedTrack]:
+    for exported_track in get_data_for_tracks(track_tasks, worker_pool, options):
+        track_id = exported_track.track_context.id
+        cache_handlers.cache_track(track_id, fingerprints[track_id], exported_track)
+        yield exported_track
+    cache_handlers.commit_cache()
 
-    print(f"{collection_name}:")
-    track_ids = sql_handlers.get_collection_tracks(collection_type, collection_id)
 
-    return generate_xml(
-        get_data_for_tracks(track_ids, out_dir, out_format, key_type, db_location),
-        collection_name,
-        xml_element,
+def warm_offset_cache(track_locations: list[str], options: ExportOptions) -> None:
+    stats = ExportStats()
+    print(f"Caching offsets for {len(track_locations)} tracks...")
+    with create_worker_pool(stats) as worker_pool:
+        offsets = offset_cache_handlers.warm_offset_cache(
+            track_locations,
+            OFFSET_CACHE_LOCATION,
+            worker_pool.process_pool,
+            get_offset_method(options),
+        )
+    flush_offset_errors(
+        {
+            track_location: offset_error
+            for track_location, (_, offset_error) in offsets.items()
+            if offset_error
+        }
     )
+    print("done")
 
 
-def export_to_rekordbox_xml(
-    out_format: str | None,
-    out_dir: str | None,
-    export_all: bool,
-    mixxx_db_location: str | None,
-    key_type: KeyType,
-    collection_type: CollectionType,
-) -> None:
-    db_location = sql_handlers.get_mixxx_db_location(mixxx_db_location)
-    if out_format and not out_dir:
+def export_to_rekordbox_xml(options: ExportOptions) -> None:
+    global _last_export_inputs
+    db_location = sql_handlers.get_mixxx_db_location(options.mixxx_db_location)
+    if options.out_format and not options.out_dir:
         raise Exception("Output directory must be specified if changing file formats.")
-    sql_handlers.set_db_location(db_location)
+    sql_handlers.set_db_location(db_location, options.db_snapshot)
+    cache_handlers.set_cache_location(
+        cache_handlers.get_cache_location(REKORDBOX_XML_LOCATION)
+        if options.use_cache
+        else None
+    )
+
+    profiler = profiling_handlers.Profiler() if options.profile else None
+    profiling_handlers.set_profiler(profiler)
+
+    with profile_span("load collections"):
+        collections = sql_handlers.get_collections(options.collection_type)
+
+    print(f"Preparing to export {len(collections)} {options.collection_type}s...\n")
+    collection_tracks = [
+        (
+            collection_name,
+            sql_handlers.get_collection_tracks(options.collection_type, collection_id),
+        )
+        for collection_id, collection_name in select_collections(
+            collections, options.export_all, options.selection
+        )
+    ]
+
+    # Every track is loaded and processed once, however many collections it's in
+    track_ids = list(
+        dict.fromkeys(
+            track_id for _, track_ids in collection_tracks for track_id in track_ids
+        )
+    )
+    with profile_span("load tracks"):
+        track_infos, cue_points = sql_handlers.get_tracks(track_ids)
+    track_ids = [track_id for track_id in track_ids if track_id in track_infos]
+    track_locations = {track_id: track_infos[track_id][-1] for track_id in track_ids}
+
+    if options.warm_offsets:
+        warm_offset_cache(list(track_locations.values()), options)
+        return
+
+    with profile_span("check cache"):
+        fingerprints = {
+            track_id: cache_handlers.get_track_fingerprint(
+                track_infos[track_id],
+                cue_points.get(track_id, []),
+                options.out_dir,
+                options.out_format,
+                options.link_mode,
+                options.key_type,
+                options.measure_offsets,
+            )
+            for track_id in track_ids
+        }
+        unchanged_track_ids = cache_handlers.get_cached_track_ids(fingerprints)
+    # Mixxx also writes to its library when a track is played, which changes nothing exported
+    export_inputs = (fingerprints, collection_tracks)
+    if (
+        options.watch
+        and export_inputs == _last_export_inputs
+        and os.path.exists(REKORDBOX_XML_LOCATION)
+    ):
+        print("No exported tracks or playlists have changed.")
+        return
+    cached_track_ids = [
+        track_id for track_id in track_ids if track_id in unchanged_track_ids
+    ]
+    changed_track_ids = [
+        track_id for track_id in track_ids if track_id not in unchanged_track_ids
+    ]
 
-    collections = sql_handlers.get_collections(collection_type)
+    with profile_span("plan"):
+        plan = plan_handlers.get_export_plan(
+            track_infos, changed_track_ids, len(cached_track_ids), options
+        )
+    if options.plan:
+        plan_handlers.print_plan(plan)
+        return
+    # Checked before anything is written, rather than failing part way through
+    plan_handlers.check_free_space(plan)
+    if options.out_dir:
+        # The plan allows for an output directory that doesn't exist yet, the manifest is opened in it
+        Path(options.out_dir).mkdir(parents=True, exist_ok=True)
 
-    print(f"Preparing to export {len(collections)} {collection_type}s...\n")
-    xml_element = None
-    for collection in collections:
-        collection_id = collection[0]
-        collection_name = collection[1]
-        xml_element = append_collection_to_element(
-            collection_id,
+    print(
+        f"Exporting {len(changed_track_ids)} tracks, "
+        f"{len(cached_track_ids)} unchanged since the last export:"
+    )
+    playlists = [
+        (
             collection_name,
-            xml_element,
-            export_all,
-            collection_type,
-            out_dir,
-            out_format,
-            key_type,
-            db_location,
+            [
+                format_track_id(track_id)
+                for track_id in collection_track_ids
+                if track_id in fingerprints
+            ],
         )
-        flush_offset_errors()
-        print("")
-    with open("rekordbox.xml", "wb") as fd:
-        fd.write(encode_xml_element(xml_element))
-        fd.close()
+        for collection_name, collection_track_ids in collection_tracks
+    ]
+
+    stats = ExportStats(cached_tracks=len(cached_track_ids))
+    try:
+        # Workers are only started if there's something for them to do, and then shared by every collection
+        with (
+            create_worker_pool(
+                stats,
+                max(IO_THREADS, options.copy_jobs or 0, options.transcode_jobs or 0),
+            )
+            if changed_track_ids
+            else nullcontext()
+        ) as worker_pool:
+            # Time spent waiting on tracks is split out of writing the XML they go into
+            exported_tracks = profile_waits(
+                chain(
+                    cache_handlers.get_cached_tracks(cached_track_ids),
+                    get_changed_tracks(
+                        [
+                            TrackTask(
+                                track_id,
+                                track_infos.pop(track_id),
+                                cue_points.get(track_id, []),
+                            )
+                            for track_id in changed_track_ids
+                        ],
+                        fingerprints,
+                        worker_pool,
+                        options,
+                    ),
+                ),
+                "waiting on tracks",
+            )
+
+            with profile_span("write xml"):
+                if options.update and os.path.exists(REKORDBOX_XML_LOCATION):
+                    xml_element, changed_tracks, changed_playlists = update_xml(
+                        exported_tracks,
+                        playlists,
+                        read_xml(REKORDBOX_XML_LOCATION),
+                        {collection_name for _, collection_name in collections},
+                    )
+                    with open(TEMP_XML_LOCATION, "wb") as fd:
+                        write_xml_element(fd, xml_element)
+                    print(
+                        f"Updated {changed_tracks} tracks and {changed_playlists} playlists."
+                    )
+                else:
+                    with open(TEMP_XML_LOCATION, "wb") as fd:
+                        write_xml(fd, exported_tracks, len(track_ids), playlists)
+        os.replace(TEMP_XML_LOCATION, REKORDBOX_XML_LOCATION)
+    except BaseException:
+        # Interrupted or failed part way, the previous rekordbox.xml is kept and the temp file removed
+        Path(TEMP_XML_LOCATION).unlink(missing_ok=True)
+        raise
+    _last_export_inputs = export_inputs
+    print_export_stats(stats)
+    flush_offset_errors(stats.offset_errors)
+    if profiler:
+        profiling_handlers.print_profile(profiler, track_locations)
+        profiling_handlers.write_trace(profiler, PROFILE_TRACE_LOCATION)
+        profiling_handlers.set_profiler(None)
+        print(f"Wrote a trace of the export to {PROFILE_TRACE_LOCATION}")
     print("done")
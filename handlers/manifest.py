@@ -0,0 +1,207 @@
+import functools
+from pathlib import Path
+import sqlite3
+from threading import Lock
+
+from handlers.cache import get_file_identity
+from handlers.mirror import is_mirror_of
+
+MANIFEST_NAME = ".export_manifest.sqlite"
+MANIFEST_TABLE_QUERY = """
+                CREATE TABLE IF NOT EXISTS exported_files (
+                    out_location TEXT PRIMARY KEY,
+                    source_location TEXT NOT NULL,
+                    out_format TEXT NOT NULL,
+                    bitrate TEXT,
+                    source_size INTEGER,
+                    source_mtime_ns INTEGER,
+                    out_size INTEGER,
+                    out_mtime_ns INTEGER,
+                    UNIQUE (source_location, out_format)
+                )
+                """
+# Seconds spent per operation and format, and the source bytes they got through
+THROUGHPUT_TABLE_QUERY = """
+                CREATE TABLE IF NOT EXISTS throughput (
+                    operation TEXT NOT NULL,
+                    out_format TEXT NOT NULL,
+                    source_bytes INTEGER NOT NULL,
+                    seconds REAL NOT NULL,
+                    PRIMARY KEY (operation, out_format)
+                )
+                """
+
+# Files are exported on a thread pool, so access to the manifest is serialised
+_manifest_lock = Lock()
+
+
+@functools.cache
+def get_manifest(out_dir: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        Path(out_dir).joinpath(MANIFEST_NAME), check_same_thread=False
+    )
+    connection.execute(MANIFEST_TABLE_QUERY)
+    connection.execute(THROUGHPUT_TABLE_QUERY)
+    connection.commit()
+    return connection
+
+
+def read_manifest(out_dir: str, query: str) -> list[tuple]:
+    # For planning, which mustn't create the manifest, or anything else, in the output directory
+    manifest_path = Path(out_dir).joinpath(MANIFEST_NAME)
+    if not manifest_path.exists():
+        return []
+    connection = sqlite3.connect(
+        f"{manifest_path.resolve().as_uri()}?mode=ro", uri=True
+    )
+    try:
+        return connection.execute(query).fetchall()
+    except sqlite3.OperationalError:
+        # A manifest from before the throughput table was added
+        return []
+    finally:
+        connection.close()
+
+
+def get_exported_files(out_dir: str) -> dict[tuple[str, str], tuple]:
+    return {
+        (source_location, out_format): exported_file
+        for source_location, out_format, *exported_file in read_manifest(
+            out_dir,
+            """
+            SELECT source_location, out_format, out_location, bitrate,
+                source_size, source_mtime_ns, out_size, out_mtime_ns
+            FROM exported_files
+            """,
+        )
+    }
+
+
+def get_throughputs(out_dir: str) -> dict[tuple[str, str], float]:
+    return {
+        (operation, out_format): source_bytes / seconds
+        for operation, out_format, source_bytes, seconds in read_manifest(
+            out_dir,
+            "SELECT operation, out_format, source_bytes, seconds FROM throughput",
+        )
+        if seconds > 0
+    }
+
+
+def record_throughput(
+    out_dir: str,
+    operation: str,
+    out_format: str | None,
+    source_bytes: int,
+    seconds: float,
+) -> None:
+    with _manifest_lock:
+        connection = get_manifest(out_dir)
+        connection.execute(
+            """
+            INSERT INTO throughput (operation, out_format, source_bytes, seconds) VALUES (?, ?, ?, ?)
+            ON CONFLICT (operation, out_format) DO UPDATE SET
+                source_bytes = source_bytes + excluded.source_bytes,
+                seconds = seconds + excluded.seconds
+            """,
+            (operation, out_format or "", source_bytes, seconds),
+        )
+        connection.commit()
+
+
+def get_numbered_location(out_file_path: Path, number: int) -> Path:
+    return out_file_path.with_name(
+        f"{out_file_path.stem} ({number}){out_file_path.suffix}"
+    )
+
+
+def is_foreign_file(
+    track_path: Path, candidate_path: Path, out_format: str | None
+) -> bool:
+    # Files the manifest doesn't know about, e.g. copied in by hand, aren't overwritten.
+    # A mirror of the same source, e.g. from before the manifest was deleted, is taken over instead.
+    # Whether a transcode came from the source can't be told, so those are left alone too.
+    return candidate_path.exists() and (
+        bool(out_format) or not is_mirror_of(track_path, candidate_path)
+    )
+
+
+def claim_out_location(
+    out_dir: str, track_path: Path, out_file_path: Path, out_format: str | None
+) -> Path:
+    # Each source keeps the name it was first given, later sources with the same name get a numbered one
+    with _manifest_lock:
+        connection = get_manifest(out_dir)
+        claimed_location = connection.execute(
+            "SELECT out_location FROM exported_files WHERE source_location = ? AND out_format = ?",
+            (str(track_path), out_format or ""),
+        ).fetchone()
+        if claimed_location:
+            return Path(claimed_location[0])
+
+        candidate_path = out_file_path
+        number = 1
+        while connection.execute(
+            "SELECT 1 FROM exported_files WHERE out_location = ?",
+            (str(candidate_path),),
+        ).fetchone() or is_foreign_file(track_path, candidate_path, out_format):
+            number += 1
+            candidate_path = get_numbered_location(out_file_path, number)
+        connection.execute(
+            "INSERT INTO exported_files (out_location, source_location, out_format) VALUES (?, ?, ?)",
+            (str(candidate_path), str(track_path), out_format or ""),
+        )
+        connection.commit()
+        return candidate_path
+
+
+def get_export_record(
+    track_path: Path, out_file_path: Path, bitrate: str | None
+) -> tuple | None:
+    source_identity = get_file_identity(str(track_path))
+    out_identity = get_file_identity(str(out_file_path))
+    if not source_identity or not out_identity:
+        return None
+    return (bitrate, *source_identity, *out_identity)
+
+
+def is_export_current(
+    out_dir: str, track_path: Path, out_file_path: Path, bitrate: str | None
+) -> bool:
+    export_record = get_export_record(track_path, out_file_path, bitrate)
+    if not export_record:
+        return False
+    with _manifest_lock:
+        recorded_export = (
+            get_manifest(out_dir)
+            .execute(
+                """
+                SELECT bitrate, source_size, source_mtime_ns, out_size, out_mtime_ns
+                FROM exported_files
+                WHERE out_location = ?
+                """,
+                (str(out_file_path),),
+            )
+            .fetchone()
+        )
+    # A changed source or bitrate, or an output touched since, means exporting it again
+    return recorded_export == export_record
+
+
+def record_export(
+    out_dir: str, track_path: Path, out_file_path: Path, bitrate: str | None
+) -> None:
+    export_record = get_export_record(track_path, out_file_path, bitrate)
+    if not export_record:
+        return
+    with _manifest_lock:
+        connection = get_manifest(out_dir)
+        connection.execute(
+            """
+            UPDATE exported_files
+            SET bitrate = ?, source_size = ?, source_mtime_ns = ?, out_size = ?, out_mtime_ns = ?
+            WHERE out_location = ?
+            """,
+            (*export_record, str(out_file_path)),
+        )
+        connection.commit()
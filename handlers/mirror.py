@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+import shutil
+
+from models import LinkMode
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl from linux/fs.h that shares a file's extents on copy-on-write filesystems (Btrfs, XFS)
+FICLONE = 0x40049409
+
+
+def is_copy(source_stat: os.stat_result, out_stat: os.stat_result) -> bool:
+    # copy2 carries the modification time across, so an unchanged copy matches on both
+    return (
+        source_stat.st_size == out_stat.st_size
+        and source_stat.st_mtime_ns == out_stat.st_mtime_ns
+    )
+
+
+def is_mirror_of(track_path: Path, out_file_path: Path) -> bool:
+    # Left by any earlier export of the source, whichever link mode it used
+    try:
+        source_stat = track_path.stat()
+        out_stat = out_file_path.stat()
+    except OSError:
+        return False
+    return os.path.samestat(source_stat, out_stat) or is_copy(source_stat, out_stat)
+
+
+def is_mirror_current(
+    track_path: Path, out_file_path: Path, link_mode: LinkMode
+) -> bool:
+    try:
+        source_stat = track_path.stat()
+        out_stat = out_file_path.stat()
+    except OSError:
+        return False
+    is_linked = os.path.samestat(source_stat, out_stat)
+    if link_mode == "hardlink" and (is_linked or source_stat.st_dev == out_stat.st_dev):
+        # A copy left by an earlier export is replaced by a link where one can be made
+        return is_linked
+    if is_linked:
+        # A link left by an earlier hardlink export, which copy and reflink replace with a file of its own
+        return False
+    return is_copy(source_stat, out_stat)
+
+
+def unlink_source_link(track_path: Path, out_file_path: Path) -> None:
+    # Writing onto a hardlink to the source would write the source file over itself
+    if out_file_path.exists() and os.path.samefile(track_path, out_file_path):
+        out_file_path.unlink()
+
+
+def copy_track(track_path: Path, out_file_path: Path) -> None:
+    unlink_source_link(track_path, out_file_path)
+    # shutil hands the copy to the kernel where it can (copy_file_range/sendfile on Linux, fcopyfile on macOS)
+    shutil.copy2(track_path, out_file_path)
+
+
+def hardlink_track(track_path: Path, out_file_path: Path) -> bool:
+    try:
+        out_file_path.unlink(missing_ok=True)
+        os.link(track_path, out_file_path)
+    except OSError:
+        return False
+    return True
+
+
+def reflink_track(track_path: Path, out_file_path: Path) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        unlink_source_link(track_path, out_file_path)
+        with open(track_path, "rb") as source, open(out_file_path, "wb") as out_file:
+            fcntl.ioctl(out_file.fileno(), FICLONE, source.fileno())
+        shutil.copystat(track_path, out_file_path)
+    except OSError:
+        out_file_path.unlink(missing_ok=True)
+        return False
+    return True
+
+
+def mirror_track(
+    track_path: Path, out_file_path: Path, link_mode: LinkMode
+) -> LinkMode | None:
+    # Returns how the track was mirrored, or None if it was already up to date
+    if is_mirror_current(track_path, out_file_path, link_mode):
+        return None
+    # Links only work on the same filesystem, otherwise fall back to a plain copy
+    if link_mode == "hardlink" and hardlink_track(track_path, out_file_path):
+        return "hardlink"
+    if link_mode == "reflink" and reflink_track(track_path, out_file_path):
+        return "reflink"
+    copy_track(track_path, out_file_path)
+    return "copy"
@@ -0,0 +1,157 @@
+import functools
+import json
+import os
+import sqlite3
+from collections.abc import Iterable
+from multiprocessing.pool import Pool
+from pathlib import Path
+from typing import Literal
+
+from handlers.cache import get_file_identity
+from handlers.offset_measure import MEASURED_SUFFIXES, measure_offset_ms
+from offset_handlers import Mp3Decoder, is_offset_in_file, probe_offset_ms
+
+# Bump whenever the table or the way offsets are worked out changes, stale entries are then dropped
+OFFSET_CACHE_VERSION = 2
+
+OFFSET_TABLE_QUERY = """
+                CREATE TABLE IF NOT EXISTS offsets (
+                    location TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    offset_ms INTEGER NOT NULL,
+                    error TEXT,
+                    PRIMARY KEY (location, method)
+                )
+                """
+# Pool workers read the cache while it's written, so wait on locks rather than failing
+OFFSET_CACHE_TIMEOUT_SEC = 30
+WARM_CHUNK_SIZE = 16
+
+# Offset in ms and the error message if it couldn't be determined
+ProbedOffset = tuple[int, str | None]
+# Where a new offset was probed and that file's identity, for the parent process to cache
+OffsetToCache = tuple[str, tuple[int, int]]
+# Either the estimate for the decoder Mixxx uses, or one measured from the audio
+OffsetMethod = Mp3Decoder | Literal["measured"]
+
+
+def get_offset_cache_location(xml_location: str) -> str:
+    return str(Path(xml_location).with_suffix(".offsets.sqlite"))
+
+
+@functools.cache
+def get_offset_connection(cache_location: str, pid: int) -> sqlite3.Connection:
+    # sqlite connections can't be shared with forked workers, so each process opens its own
+    connection = sqlite3.connect(cache_location, timeout=OFFSET_CACHE_TIMEOUT_SEC)
+    connection.execute("PRAGMA journal_mode = WAL")
+    if connection.execute("PRAGMA user_version").fetchone()[0] != OFFSET_CACHE_VERSION:
+        connection.execute("DROP TABLE IF EXISTS offsets")
+        connection.execute(f"PRAGMA user_version = {OFFSET_CACHE_VERSION}")
+    connection.execute(OFFSET_TABLE_QUERY)
+    connection.commit()
+    return connection
+
+
+def get_cached_offsets(
+    cache_location: str,
+    file_identities: dict[str, tuple[int, int]],
+    method: OffsetMethod,
+) -> dict[str, ProbedOffset]:
+    return {
+        location: (offset_ms, error)
+        for location, size, mtime_ns, offset_ms, error in get_offset_connection(
+            cache_location, os.getpid()
+        ).execute(
+            """
+            SELECT location, size, mtime_ns, offset_ms, error
+            FROM offsets
+            WHERE method = :method AND location IN (SELECT value FROM json_each(:locations))
+            """,
+            {"method": method, "locations": json.dumps(list(file_identities))},
+        )
+        # Offsets only change when the file does
+        if file_identities[location] == (size, mtime_ns)
+    }
+
+
+def cache_offsets(
+    cache_location: str,
+    probed_offsets: dict[str, ProbedOffset],
+    file_identities: dict[str, tuple[int, int]],
+    method: OffsetMethod,
+) -> None:
+    connection = get_offset_connection(cache_location, os.getpid())
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO offsets (location, method, size, mtime_ns, offset_ms, error) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (location, method, *file_identities[location], offset_ms, error)
+                for location, (offset_ms, error) in probed_offsets.items()
+            ],
+        )
+
+
+def is_offset_read_from_file(track_location: str, method: OffsetMethod) -> bool:
+    if method == "measured":
+        return Path(track_location).suffix in MEASURED_SUFFIXES
+    return is_offset_in_file(track_location)
+
+
+def probe_offset(track_location: str, method: OffsetMethod) -> ProbedOffset:
+    if method == "measured":
+        return measure_offset_ms(track_location)
+    return probe_offset_ms(track_location, method)
+
+
+def get_offset(
+    track_location: str, cache_location: str | None, method: OffsetMethod = "MAD"
+) -> tuple[ProbedOffset, tuple[int, int] | None]:
+    file_identity = get_file_identity(track_location)
+    if (
+        not cache_location
+        or not file_identity
+        or not is_offset_read_from_file(track_location, method)
+    ):
+        return probe_offset(track_location, method), None
+
+    cached_offsets = get_cached_offsets(
+        cache_location, {track_location: file_identity}, method
+    )
+    if track_location in cached_offsets:
+        return cached_offsets[track_location], None
+    # Workers only read the cache, a new offset goes back with the file's identity for the parent to write
+    return probe_offset(track_location, method), file_identity
+
+
+def probe_location_offset(
+    track_location: str, method: OffsetMethod
+) -> tuple[str, ProbedOffset]:
+    return track_location, probe_offset(track_location, method)
+
+
+def warm_offset_cache(
+    track_locations: Iterable[str],
+    cache_location: str,
+    pool: Pool,
+    method: OffsetMethod = "MAD",
+) -> dict[str, ProbedOffset]:
+    file_identities = {
+        track_location: file_identity
+        for track_location in track_locations
+        if is_offset_read_from_file(track_location, method)
+        and (file_identity := get_file_identity(track_location))
+    }
+    offsets = get_cached_offsets(cache_location, file_identities, method)
+    # Only files that are new or changed since they were last probed are read
+    probed_offsets = dict(
+        pool.imap_unordered(
+            functools.partial(probe_location_offset, method=method),
+            [location for location in file_identities if location not in offsets],
+            chunksize=WARM_CHUNK_SIZE,
+        )
+    )
+    cache_offsets(cache_location, probed_offsets, file_identities, method)
+    offsets.update(probed_offsets)
+    return offsets
@@ -0,0 +1,100 @@
+from pathlib import Path
+import subprocess
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+from offset_handlers import probe_offset_ms
+
+MEASURE_SAMPLE_RATE = 44100
+MEASURE_DURATION_SEC = 1.0
+# Well beyond any encoder delay, larger shifts are treated as a failed match
+MAX_OFFSET_SEC = 0.2
+# Normalised correlation below which the two decodes aren't trusted to line up, e.g. a silent intro
+MIN_CORRELATION = 0.5
+MEASURED_SUFFIXES = (".mp3", ".m4a")
+
+# Mixxx skips the encoder delay and priming samples recorded in the file, as ffmpeg does by default
+GAPLESS_DECODE_OPTIONS: list[str] = []
+# Decoders that ignore them, as Rekordbox does, play those samples before the audio
+RAW_DECODE_OPTIONS = ["-flags2", "+skip_manual"]
+
+
+def decode_track_start(
+    track_path: str | Path, decode_options: list[str], duration_sec: float
+) -> "np.ndarray":
+    import numpy as np
+
+    result = subprocess.run(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *decode_options,
+            "-i",
+            str(track_path),
+            "-map",
+            "0:a:0",
+            "-t",
+            str(duration_sec),
+            "-ac",
+            "1",
+            "-ar",
+            str(MEASURE_SAMPLE_RATE),
+            "-f",
+            "f32le",
+            "-",
+        ],
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise Exception(
+            f"ffmpeg failed to decode {track_path}: {result.stderr.decode(errors='replace').strip()}"
+        )
+    return np.frombuffer(result.stdout, dtype=np.float32)
+
+
+def get_lag(
+    reference: "np.ndarray", delayed: "np.ndarray", max_lag: int
+) -> tuple[int, float]:
+    import numpy as np
+
+    # Cross-correlates both decodes at once through the FFT rather than sliding one over the other
+    fft_size = 1 << (len(reference) + len(delayed) - 1).bit_length()
+    correlation = np.fft.irfft(
+        np.fft.rfft(delayed, fft_size) * np.conj(np.fft.rfft(reference, fft_size)),
+        fft_size,
+    )
+    # Index 0 is no shift, the end of the array holds negative shifts
+    window = np.concatenate((correlation[-max_lag:], correlation[: max_lag + 1]))
+    peak = int(np.argmax(window))
+    energy = float(np.linalg.norm(reference) * np.linalg.norm(delayed))
+    return peak - max_lag, float(window[peak]) / energy if energy else 0.0
+
+
+def measure_offset_ms(track_path: str | Path) -> tuple[int, str | None]:
+    if Path(track_path).suffix not in MEASURED_SUFFIXES:
+        return probe_offset_ms(track_path, "MAD")
+    try:
+        reference = decode_track_start(
+            track_path, GAPLESS_DECODE_OPTIONS, MEASURE_DURATION_SEC
+        )
+        # Decoded for longer so the delayed copy still covers all of the reference
+        delayed = decode_track_start(
+            track_path, RAW_DECODE_OPTIONS, MEASURE_DURATION_SEC + MAX_OFFSET_SEC
+        )
+    except Exception as ex:
+        offset_ms, _ = probe_offset_ms(track_path, "MAD")
+        return offset_ms, str(ex)
+
+    lag, correlation = get_lag(
+        reference, delayed, int(MAX_OFFSET_SEC * MEASURE_SAMPLE_RATE)
+    )
+    if correlation < MIN_CORRELATION:
+        # Nothing to line up, so fall back to the usual estimate
+        return probe_offset_ms(track_path, "MAD")
+    return round(lag * 1000 / MEASURE_SAMPLE_RATE), None
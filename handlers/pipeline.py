@@ -0,0 +1,119 @@
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from functools import partial
+from multiprocessing.pool import Pool
+from queue import Queue
+from threading import BoundedSemaphore, Thread
+from time import perf_counter
+from typing import Any
+
+from handlers.concurrency import AdaptiveLimit
+from handlers.profiling import Profiler, Span, call_profiled, record_profiled
+
+
+@dataclass
+class Stage:
+    name: str
+    func: Callable[[Any], Any]
+    pool: Pool
+    # Maximum number of items queued or in flight for this stage at once, which may be tuned as it runs
+    concurrency: int | AdaptiveLimit
+    # Picks the track an item belongs to, so profiled timings can be grouped per track
+    get_track_id: Callable[[Any], int] | None = None
+
+
+@dataclass
+class _FedItems:
+    count: int
+
+
+@dataclass
+class _StageError:
+    error: BaseException
+
+
+def put_profiled(
+    results: Queue,
+    profiler: Profiler,
+    stage_name: str,
+    track_id: int | None,
+    dispatched_sec: float,
+    profiled_result: tuple[Any, Span],
+) -> None:
+    result, span = profiled_result
+    record_profiled(profiler, stage_name, track_id, dispatched_sec, span)
+    results.put(result)
+
+
+def feed_stage(
+    stage: Stage,
+    items: Iterable[Any],
+    results: Queue,
+    slots: BoundedSemaphore | AdaptiveLimit,
+    profiler: Profiler | None,
+) -> None:
+    count = 0
+    try:
+        for item in items:
+            slots.acquire()
+            if profiler is None:
+                func, args, callback = stage.func, (item,), results.put
+            else:
+                func, args = call_profiled, (stage.func, item)
+                callback = partial(
+                    put_profiled,
+                    results,
+                    profiler,
+                    stage.name,
+                    stage.get_track_id(item) if stage.get_track_id else None,
+                    perf_counter(),
+                )
+            stage.pool.apply_async(
+                func,
+                args,
+                callback=callback,
+                error_callback=lambda error: results.put(_StageError(error)),
+            )
+            count += 1
+    except BaseException as error:
+        results.put(_StageError(error))
+    results.put(_FedItems(count))
+
+
+def run_stage(
+    stage: Stage, items: Iterable[Any], profiler: Profiler | None
+) -> Iterator[Any]:
+    results: Queue = Queue()
+    slots = (
+        stage.concurrency
+        if isinstance(stage.concurrency, AdaptiveLimit)
+        else BoundedSemaphore(stage.concurrency)
+    )
+    Thread(
+        target=feed_stage,
+        args=(stage, items, results, slots, profiler),
+        name=f"{stage.name}-feeder",
+        daemon=True,
+    ).start()
+
+    received = 0
+    expected = None
+    while expected is None or received < expected:
+        result = results.get()
+        if isinstance(result, _FedItems):
+            expected = result.count
+            continue
+        if isinstance(result, _StageError):
+            raise result.error
+        received += 1
+        slots.release()
+        yield result
+
+
+def run_pipeline(
+    stages: list[Stage], items: Iterable[Any], profiler: Profiler | None = None
+) -> Iterator[Any]:
+    # Results come back as soon as each item clears every stage, not in input order
+    for stage in stages:
+        items = run_stage(stage, items, profiler)
+    return iter(items)
@@ -0,0 +1,237 @@
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+
+from handlers.cache import get_file_identity
+from handlers.manifest import (
+    get_exported_files,
+    get_numbered_location,
+    get_throughputs,
+    is_foreign_file,
+)
+from handlers.mirror import is_mirror_current
+from handlers.transcode import get_bitrate_from_format, get_new_track_location
+from handlers.concurrency import COPY_START_CONCURRENCY, TRANSCODE_START_CONCURRENCY
+from models import ExportOptions
+
+# Source bytes per second for each file, used until an export to the directory has measured its own
+DEFAULT_THROUGHPUTS = {
+    "copy": 50 * 1024 * 1024,
+    "transcode": 1024 * 1024,
+}
+# Uncompressed formats, assuming 16 bit samples
+PCM_FORMATS = {"wav", "aiff"}
+PCM_SAMPLE_BYTES = 2
+FLAC_COMPRESSION_RATIO = 0.6
+
+
+@dataclass
+class ExportPlan:
+    tracks: int
+    cached_tracks: int
+    out_dir: str | None = None
+    current_files: int = 0
+    links: int = 0
+    copies: int = 0
+    transcodes: int = 0
+    missing_sources: int = 0
+    bytes_to_write: int = 0
+    # What the destination grows by, files being replaced already take up some of it
+    bytes_needed: int = 0
+    estimated_sec: float = 0.0
+    is_measured: bool = False
+    free_bytes: int | None = None
+
+
+def format_size(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024:
+            return f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}TB"
+
+
+def format_duration(seconds: float) -> str:
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m {seconds}s" if hours else f"{minutes}m {seconds}s"
+
+
+def get_existing_dir(out_dir: str) -> Path:
+    # The output directory may not exist yet, its nearest parent is on the same filesystem
+    out_path = Path(out_dir).expanduser().resolve()
+    while not out_path.exists() and out_path != out_path.parent:
+        out_path = out_path.parent
+    return out_path
+
+
+def get_estimated_out_size(
+    out_format: str, duration: int, samplerate: int, channels: int, source_size: int
+) -> int:
+    out_format = out_format.lower().lstrip(".")
+    if bitrate := get_bitrate_from_format(out_format):
+        return duration * int(bitrate.rstrip("k")) * 1000 // 8
+    pcm_size = duration * samplerate * channels * PCM_SAMPLE_BYTES
+    if out_format in PCM_FORMATS:
+        return pcm_size
+    if out_format == "flac":
+        return int(pcm_size * FLAC_COMPRESSION_RATIO)
+    return source_size
+
+
+def get_planned_out_path(
+    track_location: str,
+    out_format: str | None,
+    options: ExportOptions,
+    exported_files: dict[tuple[str, str], tuple],
+    claimed_out_locations: set[str],
+) -> Path:
+    # Picks the same name claim_out_location would, without recording it
+    if exported_file := exported_files.get((track_location, out_format or "")):
+        return Path(exported_file[0])
+    out_file_path = Path(
+        get_new_track_location(track_location, options.out_dir, out_format)
+    )
+    candidate_path = out_file_path
+    number = 1
+    while str(candidate_path) in claimed_out_locations or is_foreign_file(
+        Path(track_location), candidate_path, out_format
+    ):
+        number += 1
+        candidate_path = get_numbered_location(out_file_path, number)
+    claimed_out_locations.add(str(candidate_path))
+    return candidate_path
+
+
+def get_export_plan(
+    track_infos: dict[int, sqlite3.Row],
+    changed_track_ids: list[int],
+    cached_track_count: int,
+    options: ExportOptions,
+) -> ExportPlan:
+    plan = ExportPlan(
+        tracks=len(changed_track_ids) + cached_track_count,
+        cached_tracks=cached_track_count,
+        out_dir=options.out_dir,
+    )
+    if not options.out_dir:
+        return plan
+
+    # Only reads what's already there, planning mustn't write anything to the destination
+    out_format = options.out_format
+    exported_files = get_exported_files(options.out_dir)
+    claimed_out_locations = {
+        exported_file[0] for exported_file in exported_files.values()
+    }
+    out_device = os.stat(get_existing_dir(options.out_dir)).st_dev
+    source_bytes = 0
+    for track_id in changed_track_ids:
+        samplerate, channels, duration, *_, track_location = track_infos[track_id]
+        try:
+            source_stat = os.stat(track_location)
+        except OSError:
+            plan.missing_sources += 1
+            continue
+        out_file_path = get_planned_out_path(
+            track_location, out_format, options, exported_files, claimed_out_locations
+        )
+        out_identity = get_file_identity(str(out_file_path))
+
+        if out_format:
+            exported_file = exported_files.get((track_location, out_format))
+            if (
+                exported_file
+                and out_identity
+                and tuple(exported_file[1:])
+                == (
+                    get_bitrate_from_format(out_format),
+                    source_stat.st_size,
+                    source_stat.st_mtime_ns,
+                    *out_identity,
+                )
+            ):
+                plan.current_files += 1
+                continue
+            out_size = get_estimated_out_size(
+                out_format,
+                int(duration),
+                int(samplerate),
+                int(channels),
+                source_stat.st_size,
+            )
+            plan.transcodes += 1
+        else:
+            if is_mirror_current(
+                Path(track_location), out_file_path, options.link_mode
+            ):
+                plan.current_files += 1
+                continue
+            if options.link_mode == "hardlink" and source_stat.st_dev == out_device:
+                plan.links += 1
+                continue
+            # Reflinks are counted as copies, whether the filesystem supports them can't be told from a stat
+            out_size = source_stat.st_size
+            plan.copies += 1
+
+        source_bytes += source_stat.st_size
+        plan.bytes_to_write += out_size
+        plan.bytes_needed += max(out_size - (out_identity[0] if out_identity else 0), 0)
+
+    operation = "transcode" if out_format else "copy"
+    throughput = get_throughputs(options.out_dir).get(
+        (operation, (out_format or "").lower())
+    )
+    plan.is_measured = throughput is not None
+    # Each file's throughput was measured while the others in flight shared the disk or CPU
+    plan.estimated_sec = source_bytes / (
+        (throughput or DEFAULT_THROUGHPUTS[operation])
+        * (
+            options.transcode_jobs or TRANSCODE_START_CONCURRENCY
+            if out_format
+            else options.copy_jobs or COPY_START_CONCURRENCY
+        )
+    )
+    plan.free_bytes = shutil.disk_usage(get_existing_dir(options.out_dir)).free
+    return plan
+
+
+def print_plan(plan: ExportPlan) -> None:
+    print(
+        f"{plan.tracks} tracks selected, {plan.cached_tracks} unchanged since the last export."
+    )
+    if not plan.out_dir:
+        print("No files will be copied or transcoded without --out-dir.")
+        return
+    for count, description in [
+        (plan.transcodes, "to transcode"),
+        (plan.copies, "to copy"),
+        (plan.links, "to hardlink"),
+        (plan.current_files, "already up to date in the output directory"),
+        (plan.missing_sources, "missing their source file"),
+    ]:
+        if count:
+            print(f"{count} tracks {description}")
+    print(
+        f"{format_size(plan.bytes_to_write)} to write, "
+        f"needing {format_size(plan.bytes_needed)} of the {format_size(plan.free_bytes)} free in {plan.out_dir}."
+    )
+    print(
+        f"Estimated time for the files: {format_duration(plan.estimated_sec)}"
+        + (
+            ", from earlier exports to this directory."
+            if plan.is_measured
+            else ", from default speeds as nothing's been exported to this directory yet."
+        )
+    )
+
+
+def check_free_space(plan: ExportPlan) -> None:
+    if plan.free_bytes is not None and plan.bytes_needed > plan.free_bytes:
+        raise Exception(
+            f"The export needs {format_size(plan.bytes_needed)} in {plan.out_dir}, "
+            f"but only {format_size(plan.free_bytes)} is free."
+        )
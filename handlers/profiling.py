@@ -0,0 +1,194 @@
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import json
+import os
+import threading
+from time import perf_counter, thread_time
+from typing import Any
+
+SLOWEST_TRACK_COUNT = 10
+PERCENTILES = (50, 90, 99)
+
+
+@dataclass
+class Span:
+    name: str
+    # perf_counter() is system wide, so spans from pool workers line up with the parent's
+    start_sec: float
+    wall_sec: float
+    cpu_sec: float
+    pid: int
+    tid: int
+    track_id: int | None = None
+    # Time between handing the track to the pool and getting its result back, beyond the work itself
+    queued_sec: float = 0.0
+
+
+@dataclass
+class Profiler:
+    start_sec: float = field(default_factory=perf_counter)
+    spans: list[Span] = field(default_factory=list)
+    # Parent side time that's spread over many short waits, e.g. on pool results
+    totals: dict[str, float] = field(default_factory=dict)
+
+
+_profiler: Profiler | None = None
+
+
+def set_profiler(profiler: Profiler | None) -> None:
+    global _profiler
+    _profiler = profiler
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+@contextmanager
+def profile_span(name: str) -> Iterator[None]:
+    if _profiler is None:
+        yield
+        return
+    start_sec = perf_counter()
+    start_cpu_sec = thread_time()
+    try:
+        yield
+    finally:
+        _profiler.spans.append(
+            Span(
+                name=name,
+                start_sec=start_sec,
+                wall_sec=perf_counter() - start_sec,
+                cpu_sec=thread_time() - start_cpu_sec,
+                pid=os.getpid(),
+                tid=threading.get_ident(),
+            )
+        )
+
+
+def profile_waits[T](items: Iterable[T], name: str) -> Iterator[T]:
+    if _profiler is None:
+        yield from items
+        return
+    iterator = iter(items)
+    while True:
+        start_sec = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            break
+        finally:
+            _profiler.totals[name] = (
+                _profiler.totals.get(name, 0.0) + perf_counter() - start_sec
+            )
+        yield item
+
+
+def call_profiled(func: Callable[[Any], Any], item: Any) -> tuple[Any, Span]:
+    # Runs in the pool worker, the track and stage are filled in by the parent
+    start_sec = perf_counter()
+    start_cpu_sec = thread_time()
+    result = func(item)
+    return result, Span(
+        name="",
+        start_sec=start_sec,
+        wall_sec=perf_counter() - start_sec,
+        cpu_sec=thread_time() - start_cpu_sec,
+        pid=os.getpid(),
+        tid=threading.get_ident(),
+    )
+
+
+def record_profiled(
+    profiler: Profiler,
+    stage_name: str,
+    track_id: int | None,
+    dispatched_sec: float,
+    span: Span,
+) -> None:
+    span.name = stage_name
+    span.track_id = track_id
+    span.queued_sec = max(perf_counter() - dispatched_sec - span.wall_sec, 0.0)
+    profiler.spans.append(span)
+
+
+def get_stage_spans(profiler: Profiler) -> dict[str, list[Span]]:
+    stage_spans: dict[str, list[Span]] = {}
+    for span in profiler.spans:
+        if span.track_id is not None:
+            stage_spans.setdefault(span.name, []).append(span)
+    return stage_spans
+
+
+def print_profile(profiler: Profiler, track_locations: dict[int, str]) -> None:
+    import numpy as np
+
+    print("\nTime per stage, per track:")
+    print(
+        f"{'stage':<12}{'tracks':>8}{'wall':>10}{'cpu':>10}{'queued':>10}"
+        + "".join(f"{f'p{percentile}':>10}" for percentile in PERCENTILES)
+        + f"{'max':>10}"
+    )
+    for stage_name, spans in get_stage_spans(profiler).items():
+        wall_secs = np.array([span.wall_sec for span in spans])
+        print(
+            f"{stage_name:<12}{len(spans):>8}"
+            f"{wall_secs.sum():>9.2f}s"
+            f"{sum(span.cpu_sec for span in spans):>9.2f}s"
+            f"{sum(span.queued_sec for span in spans):>9.2f}s"
+            + "".join(
+                f"{value * 1000:>8.1f}ms"
+                for value in np.percentile(wall_secs, PERCENTILES)
+            )
+            + f"{wall_secs.max() * 1000:>8.1f}ms"
+        )
+
+    print("\nTime in the main process:")
+    for span in profiler.spans:
+        if span.track_id is None:
+            print(
+                f"{span.name:<28}{span.wall_sec:>9.2f}s wall {span.cpu_sec:>9.2f}s cpu"
+            )
+    for name, wall_sec in profiler.totals.items():
+        print(f"{name:<28}{wall_sec:>9.2f}s wall")
+
+    track_wall_secs: dict[int, float] = {}
+    for span in profiler.spans:
+        if span.track_id is not None:
+            track_wall_secs[span.track_id] = (
+                track_wall_secs.get(span.track_id, 0.0) + span.wall_sec
+            )
+    slowest_track_ids = sorted(track_wall_secs, key=track_wall_secs.get, reverse=True)[
+        :SLOWEST_TRACK_COUNT
+    ]
+    if slowest_track_ids:
+        print("\nSlowest tracks:")
+    for track_id in slowest_track_ids:
+        print(
+            f"{track_wall_secs[track_id] * 1000:>8.1f}ms "
+            f"{track_locations.get(track_id, track_id)}"
+        )
+
+
+def write_trace(profiler: Profiler, trace_location: str) -> None:
+    # Chrome's trace event format, which chrome://tracing and https://ui.perfetto.dev can open
+    trace_events = [
+        {
+            "name": span.name,
+            "cat": "track" if span.track_id is not None else "export",
+            "ph": "X",
+            "ts": (span.start_sec - profiler.start_sec) * 1_000_000,
+            "dur": span.wall_sec * 1_000_000,
+            "pid": span.pid,
+            "tid": span.tid,
+            "args": {
+                "cpu_ms": span.cpu_sec * 1000,
+                "queued_ms": span.queued_sec * 1000,
+                **({"track_id": span.track_id} if span.track_id is not None else {}),
+            },
+        }
+        for span in profiler.spans
+    ]
+    with open(trace_location, "w") as fd:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fd)
@@ -0,0 +1,85 @@
+from fnmatch import fnmatchcase
+from pathlib import Path
+import re
+import sqlite3
+
+from models import CollectionSelection
+
+
+def read_selection_file(selection_file: Path) -> list[str]:
+    # One name or glob per line, blank lines and lines starting with # are skipped
+    return [
+        line.strip()
+        for line in selection_file.read_text().splitlines()
+        if line.strip() and not line.lstrip().startswith("#")
+    ]
+
+
+def get_selection_names(selection: CollectionSelection) -> list[str]:
+    return selection.names + [
+        name
+        for selection_file in selection.files
+        for name in read_selection_file(selection_file)
+    ]
+
+
+def is_name_match(collection_name: str, name: str) -> bool:
+    return fnmatchcase(collection_name.casefold(), name.casefold())
+
+
+def is_regex_match(collection_name: str, regex: re.Pattern) -> bool:
+    return regex.search(collection_name) is not None
+
+
+def select_matching_collections(
+    collections: list[sqlite3.Row], selection: CollectionSelection
+) -> list[sqlite3.Row]:
+    names = get_selection_names(selection)
+    selected_collections = [
+        (collection_id, collection_name)
+        for collection_id, collection_name in collections
+        if collection_id in selection.ids
+        or any(is_name_match(collection_name, name) for name in names)
+        or any(is_regex_match(collection_name, regex) for regex in selection.regexes)
+    ]
+
+    # A typo shouldn't quietly leave a collection out of an unattended export
+    collection_ids = {collection_id for collection_id, _ in collections}
+    unmatched = [
+        *(
+            name
+            for name in names
+            if not any(is_name_match(collection[1], name) for collection in collections)
+        ),
+        *(
+            regex.pattern
+            for regex in selection.regexes
+            if not any(
+                is_regex_match(collection[1], regex) for collection in collections
+            )
+        ),
+        *(
+            str(collection_id)
+            for collection_id in selection.ids
+            if collection_id not in collection_ids
+        ),
+    ]
+    for selector in unmatched:
+        print(f"Nothing matches {selector}")
+    if not selected_collections:
+        raise Exception("No collections match the selection.")
+    return selected_collections
+
+
+def select_collections(
+    collections: list[sqlite3.Row],
+    export_all: bool,
+    selection: CollectionSelection | None,
+) -> list[sqlite3.Row]:
+    if selection:
+        return select_matching_collections(collections, selection)
+    return [
+        collection
+        for collection in collections
+        if export_all or input(f"Export {collection[1]}? [y/n]").lower().strip() == "y"
+    ]
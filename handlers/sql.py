@@ -1,6 +1,7 @@
 import functools
 from os import path
 import os
+from pathlib import Path
 import sqlite3
 
 from models import CollectionType
@@ -13,8 +14,12 @@ COLLECTION_TRACKS_QUERY_MAP: dict[CollectionType, str] = {
     "playlists": "SELECT track_id FROM PlaylistTracks WHERE playlist_id = :id ORDER BY position",
     "crates": "SELECT track_id FROM crate_tracks WHERE crate_id = :id",
 }
+EXPORT_TRACKS_TABLE_QUERY = (
+    "CREATE TEMP TABLE IF NOT EXISTS export_tracks (id INTEGER PRIMARY KEY)"
+)
 TRACK_INFO_QUERY = """
                 SELECT
+                    l.id,
                     l.samplerate,
                     l.channels,
                     l.duration,
@@ -30,17 +35,33 @@ TRACK_INFO_QUERY = """
                     l.color,
                     tl.location
                 FROM
+                    temp.export_tracks et
+                INNER JOIN
                     library l
+                ON l.id = et.id
                 INNER JOIN
                     track_locations tl
-                USING (id)
-                WHERE
-                    id = :id
+                ON tl.id = l.id
+                """
+CUE_POINTS_QUERY = """
+                SELECT c.track_id, c.hotcue, c.position, c.color
+                FROM cues c
+                INNER JOIN temp.export_tracks et
+                ON et.id = c.track_id
+                WHERE c.type = 1 and c.hotcue >= 0
                 """
 
-CUE_POINT_QUERY = "SELECT hotcue,position,color from cues WHERE cues.type = 1 and cues.hotcue >= 0 and cues.track_id = :id"
+# Pages are read straight from the OS page cache rather than copied into SQLite's own
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+# Built in the snapshot only, an export mustn't change Mixxx's own database
+SNAPSHOT_INDEX_QUERIES = [
+    "CREATE INDEX IF NOT EXISTS export_cues_track_id ON cues (track_id)",
+    "CREATE INDEX IF NOT EXISTS export_playlist_tracks_playlist_id ON PlaylistTracks (playlist_id)",
+]
 
 global _db_location
+_db_snapshot = False
 
 
 def get_mixxx_db_location(custom_db_location: str | None) -> str:
@@ -57,47 +78,58 @@ def get_mixxx_db_location(custom_db_location: str | None) -> str:
         return r"~/.mixxx/mixxxdb.sqlite"
 
 
-def set_db_location(db_location: str) -> None:
-    global _db_location
+def set_db_location(db_location: str, snapshot: bool = False) -> None:
+    global _db_location, _db_snapshot
     _db_location = db_location
+    _db_snapshot = snapshot
+
+
+def get_read_only_uri(db_location: str) -> str:
+    return f"{Path(db_location).expanduser().resolve().as_uri()}?mode=ro"
+
+
+def take_snapshot(connection: sqlite3.Connection) -> sqlite3.Connection:
+    # One consistent copy, after which Mixxx is free to write while the export reads
+    snapshot = sqlite3.connect(":memory:", check_same_thread=False)
+    connection.backup(snapshot)
+    connection.close()
+    for query in SNAPSHOT_INDEX_QUERIES:
+        snapshot.execute(query)
+    snapshot.commit()
+    return snapshot
 
 
 @functools.cache
 def get_connection() -> sqlite3.Connection:
     if not _db_location:
         raise Exception("Database location not set.")
-    return sqlite3.connect(_db_location, check_same_thread=False)
-
-
-def get_cursor() -> sqlite3.Cursor:
-    return get_connection().cursor()
+    if not path.exists(path.expanduser(_db_location)):
+        raise Exception(f"Mixxx database not found at {_db_location}.")
+    # Read only, so an export never takes a write lock on a library Mixxx has open
+    connection = sqlite3.connect(
+        get_read_only_uri(_db_location), uri=True, check_same_thread=False
+    )
+    if _db_snapshot:
+        return take_snapshot(connection)
+    connection.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    connection.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    return connection
 
 
-def get_track_info(track_id: str) -> sqlite3.Row:
-    return (
-        get_cursor()
-        .execute(
-            TRACK_INFO_QUERY,
-            {"id": track_id},
-        )
-        .fetchone()
-    )
+def close_connection() -> None:
+    # Closed rather than just dropped, an open connection holds on to its read snapshot, or a whole in-memory copy
+    if get_connection.cache_info().currsize:
+        get_connection().close()
+    get_connection.cache_clear()
 
 
-def get_cue_points(track_id: str) -> list[sqlite3.Row]:
-    return (
-        get_cursor()
-        .execute(
-            CUE_POINT_QUERY,
-            {"id": track_id},
-        )
-        .fetchall()
-    )
+def get_cursor() -> sqlite3.Cursor:
+    return get_connection().cursor()
 
 
-def get_collection_tracks(collection_type: str, collection_id: str) -> list[str]:
+def get_collection_tracks(collection_type: str, collection_id: str) -> list[int]:
     return [
-        track[0]
+        int(track[0])
         for track in get_cursor().execute(
             COLLECTION_TRACKS_QUERY_MAP[collection_type],
             {"id": collection_id},
@@ -107,3 +139,28 @@ def get_collection_tracks(collection_type: str, collection_id: str) -> list[str]
 
 def get_collections(collection_type: str) -> list[sqlite3.Row]:
     return get_cursor().execute(COLLECTION_QUERY_MAP[collection_type]).fetchall()
+
+
+def set_export_tracks(track_ids: list[int]) -> None:
+    cursor = get_cursor()
+    cursor.execute(EXPORT_TRACKS_TABLE_QUERY)
+    cursor.execute("DELETE FROM temp.export_tracks")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO temp.export_tracks (id) VALUES (?)",
+        ((track_id,) for track_id in track_ids),
+    )
+    get_connection().commit()
+
+
+def get_tracks(
+    track_ids: list[int],
+) -> tuple[dict[int, sqlite3.Row], dict[int, list[sqlite3.Row]]]:
+    set_export_tracks(track_ids)
+    track_infos = {
+        track_info[0]: track_info[1:]
+        for track_info in get_cursor().execute(TRACK_INFO_QUERY)
+    }
+    cue_points: dict[int, list[sqlite3.Row]] = {}
+    for cue_point in get_cursor().execute(CUE_POINTS_QUERY):
+        cue_points.setdefault(cue_point[0], []).append(cue_point[1:])
+    return track_infos, cue_points
@@ -1,14 +1,15 @@
-import os
-from pydub import AudioSegment
 from pathlib import Path
-import shutil
+import subprocess
+from time import perf_counter
 
-from tinytag import TinyTag
-
-from multiprocessing.synchronize import Semaphore
-
-# Prevent spawning too many processes
-EXPORT_SEMAPHORE_COUNT = os.cpu_count() // 2
+from handlers.manifest import (
+    claim_out_location,
+    is_export_current,
+    record_export,
+    record_throughput,
+)
+from handlers.mirror import mirror_track
+from models import LinkMode
 
 BITRATE_MAP = {
     "mp3": "320k",
@@ -20,33 +21,96 @@ def get_bitrate_from_format(out_format: str) -> str | None:
     return BITRATE_MAP.get(out_format.lower())
 
 
-def transcode_track(
-    track_path: Path, out_path: Path, out_format: str, export_semaphore: Semaphore
-) -> str:
-    with export_semaphore:
-        segment = AudioSegment.from_file(track_path, format=track_path.suffix[1:])
-        tags = TinyTag.get(track_path)
-        new_file = out_path.joinpath(f"{track_path.stem}.{out_format}")
-        segment.export(
-            new_file,
-            format=out_format,
-            bitrate=get_bitrate_from_format(out_format),
-            tags=tags.as_dict(),
+# Extra muxer options so tags survive formats that don't store them by default
+FORMAT_OPTIONS_MAP = {
+    "aiff": ["-write_id3v2", "1"],
+    "mp3": ["-id3v2_version", "3"],
+}
+
+
+def get_transcode_command(
+    track_path: Path, new_file: Path, out_format: str
+) -> list[str]:
+    command = [
+        "ffmpeg",
+        "-nostdin",
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        "-i",
+        str(track_path),
+        "-map",
+        "0:a:0",
+        "-map_metadata",
+        "0",
+    ]
+    if bitrate := get_bitrate_from_format(out_format):
+        command += ["-b:a", bitrate]
+    command += FORMAT_OPTIONS_MAP.get(out_format.lower(), [])
+    return command + ["-f", out_format, str(new_file)]
+
+
+def transcode_track(track_path: Path, new_file: Path, out_format: str) -> str:
+    # ffmpeg streams straight from the source to the new file, so memory use doesn't grow with track length
+    result = subprocess.run(
+        get_transcode_command(track_path, new_file, out_format),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise Exception(
+            f"ffmpeg failed to transcode {track_path}: {result.stderr.decode(errors='replace').strip()}"
         )
     return str(new_file)
 
 
+def get_new_track_location(
+    track_location: str, out_dir: str, out_format: str | None
+) -> str:
+    track_path = Path(track_location)
+    if out_format:
+        return str(Path(out_dir).joinpath(f"{track_path.stem}.{out_format}"))
+    return str(Path(out_dir).joinpath(track_path.name))
+
+
 def change_track_location(
     track_location: str,
     out_dir: str,
     out_format: str | None,
-    export_semaphore: Semaphore,
-) -> str:
+    link_mode: LinkMode = "copy",
+) -> tuple[str, int]:
+    # Returns the new location and how many source bytes were copied or transcoded to get there
     track_path = Path(track_location)
-    out_dir_path = Path(out_dir)
-    if out_format:
-        return transcode_track(track_path, out_dir_path, out_format, export_semaphore)
-    else:
-        out_file_path = out_dir_path.joinpath(track_path.name)
-        shutil.copy2(track_path, out_file_path)
-        return str(out_file_path)
+    out_file_path = claim_out_location(
+        out_dir,
+        track_path,
+        Path(get_new_track_location(track_location, out_dir, out_format)),
+        out_format,
+    )
+    if not out_format:
+        start = perf_counter()
+        if mirror_track(track_path, out_file_path, link_mode) != "copy":
+            # Already up to date, or linked without writing any data
+            return str(out_file_path), 0
+        source_bytes = track_path.stat().st_size
+        # Timed so --plan can estimate how long copies to this directory take
+        record_throughput(out_dir, "copy", None, source_bytes, perf_counter() - start)
+        return str(out_file_path), source_bytes
+
+    bitrate = get_bitrate_from_format(out_format)
+    if is_export_current(out_dir, track_path, out_file_path, bitrate):
+        return str(out_file_path), 0
+    start = perf_counter()
+    new_location = transcode_track(track_path, out_file_path, out_format)
+    source_bytes = track_path.stat().st_size
+    record_throughput(
+        out_dir,
+        "transcode",
+        out_format.lower(),
+        source_bytes,
+        perf_counter() - start,
+    )
+    record_export(out_dir, track_path, out_file_path, bitrate)
+    return new_location, source_bytes
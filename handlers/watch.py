@@ -0,0 +1,76 @@
+import os
+import sqlite3
+from time import monotonic, sleep
+
+from handlers.cache import get_file_identity
+from handlers import sql as sql_handlers
+from handlers.export import export_to_rekordbox_xml
+from models import ExportOptions
+
+POLL_INTERVAL_SEC = 0.5
+# Mixxx saves an edit over several transactions, e.g. a track and then its cues, so the export waits for them to stop
+DEBOUNCE_SEC = 1.0
+# Exports anyway once changes have kept coming for this long
+MAX_DEBOUNCE_SEC = 10.0
+# Mixxx's database is in WAL mode, commits land in the -wal file and only reach the database file at a checkpoint
+WATCHED_SUFFIXES = ["", "-wal"]
+
+
+def get_db_file_identities(db_location: str) -> list[tuple[int, int] | None]:
+    return [get_file_identity(db_location + suffix) for suffix in WATCHED_SUFFIXES]
+
+
+def get_data_version(connection: sqlite3.Connection) -> int:
+    return connection.execute("PRAGMA data_version").fetchone()[0]
+
+
+def wait_for_change(db_location: str, connection: sqlite3.Connection) -> None:
+    file_identities = get_db_file_identities(db_location)
+    data_version = get_data_version(connection)
+    first_change_sec = last_change_sec = None
+    while True:
+        sleep(POLL_INTERVAL_SEC)
+        now_sec = monotonic()
+        if last_change_sec is not None and (
+            now_sec - last_change_sec >= DEBOUNCE_SEC
+            or now_sec - first_change_sec >= MAX_DEBOUNCE_SEC
+        ):
+            return
+        # A stat is cheaper than a query, the data version is only read once the files have changed
+        new_file_identities = get_db_file_identities(db_location)
+        if new_file_identities == file_identities:
+            continue
+        file_identities = new_file_identities
+        # Checkpoints change the files too, but not the data
+        new_data_version = get_data_version(connection)
+        if new_data_version == data_version:
+            continue
+        data_version = new_data_version
+        if first_change_sec is None:
+            first_change_sec = now_sec
+        last_change_sec = now_sec
+
+
+def watch_and_export(options: ExportOptions) -> None:
+    export_to_rekordbox_xml(options)
+    db_location = os.path.expanduser(
+        sql_handlers.get_mixxx_db_location(options.mixxx_db_location)
+    )
+    # Its own connection, data_version only changes for commits made by other connections
+    connection = sqlite3.connect(sql_handlers.get_read_only_uri(db_location), uri=True)
+    print(f"\nWatching {db_location} for changes, press Ctrl+C to stop.")
+    try:
+        while True:
+            wait_for_change(db_location, connection)
+            print("\nMixxx's library changed, exporting...")
+            # Reconnects, so a --snapshot export takes a fresh copy
+            sql_handlers.close_connection()
+            try:
+                export_to_rekordbox_xml(options)
+            except Exception as ex:
+                # e.g. Mixxx holding a lock, a missing source file or a failed transcode, the next change tries again
+                print(f"Export failed, waiting for the next change: {ex}")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        connection.close()
@@ -0,0 +1,78 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import multiprocessing
+from multiprocessing.pool import Pool, ThreadPool
+from time import perf_counter
+
+from handlers.concurrency import (
+    COPY_MAX_CONCURRENCY,
+    CPU_COUNT,
+    TRANSCODE_MAX_CONCURRENCY,
+)
+
+# Tracks queued or in flight per pipeline stage, enough that a worker has its next track waiting when it finishes one
+METADATA_CONCURRENCY = CPU_COUNT * 8
+OFFSET_CONCURRENCY = CPU_COUNT * 8
+# Copies and transcodes have their own limits, tuned as they run, the pool just needs room for the larger
+IO_THREADS = max(COPY_MAX_CONCURRENCY, TRANSCODE_MAX_CONCURRENCY)
+# Imported once by the fork server rather than again by every worker it starts
+FORKSERVER_PRELOAD = ["handlers.export", "beat_handlers"]
+
+
+@dataclass
+class ExportStats:
+    spawn_sec: float = 0.0
+    work_sec: float = 0.0
+    teardown_sec: float = 0.0
+    processed_tracks: int = 0
+    cached_tracks: int = 0
+    # Most copies or transcodes run at once, by the limit's name
+    peak_concurrency: dict[str, int] = field(default_factory=dict)
+    # Track location -> reason its offset couldn't be determined
+    offset_errors: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class WorkerPool:
+    # CPU bound work, e.g. parsing beat grids and MP3 headers
+    process_pool: Pool
+    # File copies and ffmpeg transcodes, which mostly wait on the disk or a subprocess
+    io_pool: ThreadPool
+    stats: ExportStats
+
+
+@contextmanager
+def create_worker_pool(
+    stats: ExportStats, io_threads: int = IO_THREADS
+) -> Iterator[WorkerPool]:
+    start = perf_counter()
+    multiprocessing.set_forkserver_preload(FORKSERVER_PRELOAD)
+    with (
+        Pool() as process_pool,
+        ThreadPool(io_threads) as io_pool,
+    ):
+        worker_pool = WorkerPool(
+            process_pool=process_pool,
+            io_pool=io_pool,
+            stats=stats,
+        )
+        stats.spawn_sec += perf_counter() - start
+        yield worker_pool
+        teardown_start = perf_counter()
+    stats.teardown_sec += perf_counter() - teardown_start
+
+
+def print_export_stats(stats: ExportStats) -> None:
+    if not stats.processed_tracks:
+        return
+    print(
+        f"Processed {stats.processed_tracks} tracks in {stats.work_sec:.2f}s, "
+        f"reused {stats.cached_tracks} unchanged tracks."
+    )
+    print(
+        f"Worker pool start-up took {stats.spawn_sec:.2f}s "
+        f"and shutdown {stats.teardown_sec:.2f}s."
+    )
+    for name, peak_concurrency in stats.peak_concurrency.items():
+        print(f"Ran up to {peak_concurrency} {name} jobs at once.")
@@ -1,11 +1,29 @@
 import argparse
-from handlers.export import export_to_rekordbox_xml
+from pathlib import Path
+import re
+from typing import get_args
 from models import (
+    CollectionSelection,
     CollectionType,
+    ExportOptions,
     KeyType,
+    LinkMode,
 )
 
 
+def compile_regex(pattern: str) -> re.Pattern:
+    try:
+        return re.compile(pattern)
+    except re.error as ex:
+        raise argparse.ArgumentTypeError(f"invalid regular expression: {ex}")
+
+
+def positive_int(value: str) -> int:
+    if not value.isdigit() or int(value) < 1:
+        raise argparse.ArgumentTypeError(f"must be a whole number above 0, not {value}")
+    return int(value)
+
+
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument(
     "--out-dir", type=str, help="Outputs tracks to a new directory."
@@ -19,11 +37,48 @@ arg_parser.add_argument(
     "-a",
     "--export-all",
     action="store_true",
-    help="Export all playlists without prompting. May take a while and fill up your drive if --out-dir is set.",
+    help="Export all playlists without prompting. May take a while if --out-dir is set, see --plan.",
+)
+arg_parser.add_argument(
+    "-s",
+    "--select",
+    action="append",
+    default=[],
+    metavar="NAME",
+    help="Export the playlists or crates with this name without prompting, may be a glob such as 'Techno*' and is matched ignoring case. Can be given more than once.",
+)
+arg_parser.add_argument(
+    "--select-regex",
+    action="append",
+    type=compile_regex,
+    default=[],
+    metavar="REGEX",
+    help="Export the playlists or crates whose name matches this regular expression. Can be given more than once.",
+)
+arg_parser.add_argument(
+    "--select-id",
+    action="append",
+    type=int,
+    default=[],
+    metavar="ID",
+    help="Export the playlist or crate with this id from the Mixxx database. Can be given more than once.",
+)
+arg_parser.add_argument(
+    "--select-file",
+    action="append",
+    type=Path,
+    default=[],
+    metavar="FILE",
+    help="Export the playlists or crates named in this file, one name or glob per line.",
 )
 arg_parser.add_argument(
     "--mixxx-db-location", type=str, help="Specify Mixxx's DB location if non-standard."
 )
+arg_parser.add_argument(
+    "--snapshot",
+    action="store_true",
+    help="Copy Mixxx's database into memory and export from the copy, so a running Mixxx isn't held up by the export.",
+)
 arg_parser.add_argument(
     "--key-type",
     type=KeyType,
@@ -35,20 +90,108 @@ arg_parser.add_argument(
     action="store_true",
     help="Source the tracks from crates instead of playlists, XML output will still be playlists.",
 )
+arg_parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Reprocess every track instead of reusing tracks unchanged since the last export.",
+)
+arg_parser.add_argument(
+    "-u",
+    "--update",
+    action="store_true",
+    help="Update the existing rekordbox.xml, only replacing tracks and playlists that have changed.",
+)
+arg_parser.add_argument(
+    "--link-mode",
+    type=str,
+    choices=get_args(LinkMode),
+    help="How --out-dir mirrors tracks when --format isn't set. "
+    "hardlink and reflink only work within one filesystem and fall back to copying. Defaults to copy.",
+)
+
+arg_parser.add_argument(
+    "--copy-jobs",
+    type=positive_int,
+    help="Copy this many files at once, instead of adjusting it to what the output drive keeps up with.",
+)
+arg_parser.add_argument(
+    "--transcode-jobs",
+    type=positive_int,
+    help="Run this many ffmpeg transcodes at once, instead of adjusting it to the CPU and output drive.",
+)
+arg_parser.add_argument(
+    "--warm-offsets",
+    action="store_true",
+    help="Work out and cache MP3 offsets for the selected tracks without exporting, so a later export doesn't have to.",
+)
+
+arg_parser.add_argument(
+    "--measure-offsets",
+    action="store_true",
+    help="Measure MP3 and M4A offsets from the audio with ffmpeg instead of estimating them.",
+)
+arg_parser.add_argument(
+    "--plan",
+    action="store_true",
+    help="Report how many tracks would be copied or transcoded, how much space they'd take and roughly how long it would take, without exporting.",
+)
+arg_parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="Keep running after the export and export again a second or so after Mixxx's library changes, only reprocessing changed tracks.",
+)
+arg_parser.add_argument(
+    "--profile",
+    action="store_true",
+    help="Time each stage of the export per track, print a summary and write a trace to rekordbox.trace.json.",
+)
 
 
 def main() -> None:
     args = arg_parser.parse_args()
-    out_format: str | None = args.format
-    out_dir: str | None = args.out_dir
-    export_all: bool = args.export_all
-    mixxx_db_location: str | None = args.mixxx_db_location
-    key_type: KeyType = args.key_type or KeyType.LANCELOT
+    selection = CollectionSelection(
+        names=args.select,
+        regexes=args.select_regex,
+        ids=args.select_id,
+        files=args.select_file,
+    )
+    if selection and args.export_all:
+        arg_parser.error("--export-all can't be combined with --select options.")
+    if args.watch and not (selection or args.export_all):
+        arg_parser.error(
+            "--watch needs --export-all or --select options, it can't prompt for playlists on every change."
+        )
+    if args.watch and (args.plan or args.warm_offsets):
+        arg_parser.error("--watch can't be combined with --plan or --warm-offsets.")
+    # Imported after parsing so --help and bad arguments don't wait on lxml, numpy and the rest
+    from handlers.export import export_to_rekordbox_xml
+    from handlers.watch import watch_and_export
+
     use_crates: bool = args.use_crates
     collection_type: CollectionType = "crates" if use_crates else "playlists"
 
-    export_to_rekordbox_xml(
-        out_format, out_dir, export_all, mixxx_db_location, key_type, collection_type
+    export = watch_and_export if args.watch else export_to_rekordbox_xml
+    export(
+        ExportOptions(
+            out_dir=args.out_dir,
+            out_format=args.format,
+            export_all=args.export_all,
+            mixxx_db_location=args.mixxx_db_location,
+            db_snapshot=args.snapshot,
+            key_type=args.key_type or KeyType.LANCELOT,
+            collection_type=collection_type,
+            use_cache=not args.no_cache,
+            update=args.update,
+            link_mode=args.link_mode or "copy",
+            copy_jobs=args.copy_jobs,
+            transcode_jobs=args.transcode_jobs,
+            warm_offsets=args.warm_offsets,
+            measure_offsets=args.measure_offsets,
+            profile=args.profile,
+            plan=args.plan,
+            selection=selection or None,
+            watch=args.watch,
+        )
     )
 
 
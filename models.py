@@ -1,22 +1,28 @@
+from array import array
+from collections.abc import Iterator
 from dataclasses import dataclass, field
 from enum import StrEnum, auto
+from pathlib import Path
+import re
 from typing import Literal
-from offset_handlers import get_offset_sec
-from proto.beats_pb2 import BeatGrid, BeatMap
 
 CollectionType = Literal["playlists", "crates"]
+LinkMode = Literal["copy", "hardlink", "reflink"]
 
 
 SERATO_COLOURS = [
-    "0xc02626",  # Red
-    "0xf8821a",  # Orange
-    "0xfac313",  # Yellow
-    "0x1fad26",  # Green
-    "0x00FFFF",  # Cyan
-    "0x173ba2",  # Blue
-    "0x6823b6",  # Indigo
-    "0xce359e",  # Light Magenta
+    0xC02626,  # Red
+    0xF8821A,  # Orange
+    0xFAC313,  # Yellow
+    0x1FAD26,  # Green
+    0x00FFFF,  # Cyan
+    0x173BA2,  # Blue
+    0x6823B6,  # Indigo
+    0xCE359E,  # Light Magenta
 ]
+# Cue colours are only kept if they're written with six hex digits, anything else gets a Serato colour
+MIN_CUE_COLOUR = 0x100000
+MAX_CUE_COLOUR = 0xFFFFFF
 
 # 0 star = "0", 1 star = "51", 2 stars = "102", 3 stars = "153", 4 stars = "204", 5 stars = "255"
 RATING_MAP = {0: 0, 1: 51, 2: 102, 3: 153, 4: 204, 5: 255}
@@ -144,16 +150,60 @@ class KeyType(StrEnum):
                 return MUSICAL_MAP[key_id]
 
 
-BeatsVersion = Literal["BeatGrid-2.0", "BeatMap-1.0"]
+@dataclass
+class CollectionSelection:
+    # Name globs, matched ignoring case
+    names: list[str] = field(default_factory=list)
+    regexes: list[re.Pattern] = field(default_factory=list)
+    ids: list[int] = field(default_factory=list)
+    # Files holding a name or glob per line
+    files: list[Path] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.names or self.regexes or self.ids or self.files)
 
 
 @dataclass
+class ExportOptions:
+    out_dir: str | None = None
+    out_format: str | None = None
+    export_all: bool = False
+    mixxx_db_location: str | None = None
+    key_type: KeyType = KeyType.LANCELOT
+    collection_type: CollectionType = "playlists"
+    use_cache: bool = True
+    update: bool = False
+    link_mode: LinkMode = "copy"
+    # Fixed numbers of copies or transcodes at once, otherwise they're tuned as the export runs
+    copy_jobs: int | None = None
+    transcode_jobs: int | None = None
+    warm_offsets: bool = False
+    measure_offsets: bool = False
+    profile: bool = False
+    # Report what the export would do, without doing it
+    plan: bool = False
+    # Read from an in-memory copy of the Mixxx database rather than the file itself
+    db_snapshot: bool = False
+    # Collections to export without prompting, instead of asking about each one
+    selection: CollectionSelection | None = None
+    # Keep running and export again whenever Mixxx's library changes
+    watch: bool = False
+
+
+BeatsVersion = Literal["BeatGrid-2.0", "BeatMap-1.0"]
+
+BEATS_PER_BAR = 4
+
+
+@dataclass(slots=True)
 class BeatGridInfo:
     start_pos: int
     beats_version: BeatsVersion
     samplerate: float
-    bpm: float | None = None
-    offset_sec: float = 0.0
+    bpm: float | None
+    offset_sec: float
+    # Later tempo segments of a variable tempo BeatMap, as (start_pos, bpm, beat number within the bar)
+    tempo_changes: list[tuple[int, float, int]]
 
     def __init__(
         self,
@@ -163,22 +213,19 @@ class BeatGridInfo:
     ):
         self.beats_version = beats_version
         self.samplerate = samplerate
+        self.bpm = None
+        self.offset_sec = 0.0
+        self.tempo_changes = []
+        # Protobuf and numpy are only loaded once there are beats to decode, not by the CLI or cached exports
+        import beat_handlers
+
         match beats_version:
             case "BeatGrid-2.0":
-                beatgrid = BeatGrid()
-                beatgrid.ParseFromString(beat_bytes)
-                self.start_pos = beatgrid.first_beat.frame_position
-                self.bpm = beatgrid.bpm.bpm
+                self.start_pos, self.bpm = beat_handlers.read_beatgrid(beat_bytes)
             case "BeatMap-1.0":
-                # Just use the first available beat for now, we can get BPM from the track context
-                beatmap = BeatMap()
-                beatmap.ParseFromString(beat_bytes)
-                first_beat = next(
-                    beat
-                    for beat in sorted(beatmap.beat, key=lambda b: -b.source)
-                    if beat.enabled and beat.frame_position > 1
+                self.start_pos, self.bpm, self.tempo_changes = (
+                    beat_handlers.read_beatmap(beat_bytes, samplerate)
                 )
-                self.start_pos = first_beat.frame_position
 
     @property
     def start_sec(self) -> float:
@@ -187,12 +234,18 @@ class BeatGridInfo:
         if not self.bpm:
             return start_sec + self.offset_sec
         interval_sec = 60 / self.bpm
-        beats_per_bar = 4
 
-        return (start_sec % (beats_per_bar * interval_sec)) + self.offset_sec
+        return (start_sec % (BEATS_PER_BAR * interval_sec)) + self.offset_sec
 
+    @property
+    def tempo_segments(self) -> list[tuple[float, float | None, int]]:
+        return [(self.start_sec, self.bpm, 1)] + [
+            (start_pos / self.samplerate + self.offset_sec, bpm, beat_number)
+            for start_pos, bpm, beat_number in self.tempo_changes
+        ]
 
-@dataclass
+
+@dataclass(slots=True)
 class TrackContext:
     id: str
     title: str
@@ -209,39 +262,36 @@ class TrackContext:
     colour: str
 
 
-@dataclass
-class CueColour:
-    hex_rgb: hex  # 0xRRGGBB
+@dataclass(slots=True)
+class CuePoint:
+    cue_index: int
+    # Milliseconds
+    cue_position: float
+    colour: int  # 0xRRGGBB
 
     @property
-    def r_int(self) -> int:
-        return int(self.hex_rgb[:4], 0)
+    def red(self) -> int:
+        return self.colour >> 16
 
     @property
-    def g_int(self) -> int:
-        return int(self.hex_rgb[:2] + self.hex_rgb[4:6], 0)
+    def green(self) -> int:
+        return (self.colour >> 8) & 0xFF
 
     @property
-    def b_int(self) -> int:
-        return int(self.hex_rgb[:2] + self.hex_rgb[6:8], 0)
-
-
-@dataclass
-class CuePoint(dict):
-    cue_type: hex
-    cue_index: int
-    cue_position: float
-    cue_color: CueColour
-    cue_text: str = ""
+    def blue(self) -> int:
+        return self.colour & 0xFF
 
 
-@dataclass
+@dataclass(slots=True)
 class ExportedTrack:
     id: str
     track_context: TrackContext
-    beat_grid: BeatGridInfo | None = None
-    cue_points: list[CuePoint] = field(default_factory=list)
-    offset_sec: float = 0.0
+    beat_grid: BeatGridInfo | None
+    # Cues are kept as packed columns, so a track pickles to a few short byte strings rather than an object per cue
+    cue_indexes: array
+    cue_positions: array
+    cue_colours: array
+    offset_sec: float
 
     def __init__(
         self,
@@ -252,22 +302,41 @@ class ExportedTrack:
     ):
         self.id = id
         self.track_context = track_context
-        self.offset_sec = get_offset_sec(self.track_context.location)
+        self.offset_sec = 0.0
+        self.beat_grid = None
         if beat_grid:
             self._add_beat_grid(beat_grid)
-        self.cue_points = []
-        for cue_point in cue_points:
-            self._add_new_cue_point(cue_point)
+        self.cue_indexes = array("i", [cue_point.cue_index for cue_point in cue_points])
+        self.cue_positions = array(
+            "d", [cue_point.cue_position + self.offset_sec for cue_point in cue_points]
+        )
+        self.cue_colours = array(
+            "I",
+            [
+                cue_point.colour
+                if MIN_CUE_COLOUR <= cue_point.colour <= MAX_CUE_COLOUR
+                else SERATO_COLOURS[cue_number % len(SERATO_COLOURS)]
+                for cue_number, cue_point in enumerate(cue_points)
+            ],
+        )
+
+    @property
+    def cue_points(self) -> Iterator[CuePoint]:
+        for cue_index, cue_position, colour in zip(
+            self.cue_indexes, self.cue_positions, self.cue_colours
+        ):
+            yield CuePoint(cue_index, cue_position, colour)
+
+    def set_offset_sec(self, offset_sec: float) -> None:
+        shift_sec = offset_sec - self.offset_sec
+        self.offset_sec = offset_sec
+        if self.beat_grid:
+            self.beat_grid.offset_sec = offset_sec
+        self.cue_positions = array(
+            "d", [cue_position + shift_sec for cue_position in self.cue_positions]
+        )
 
     def _add_beat_grid(self, beat_grid: BeatGridInfo):
         beat_grid.offset_sec = self.offset_sec
         beat_grid.bpm = beat_grid.bpm or self.track_context.bpm
         self.beat_grid = beat_grid
-
-    def _add_new_cue_point(self, cue_point: CuePoint):
-        if not len(cue_point.cue_color.hex_rgb) == 8:
-            cue_point.cue_color.hex_rgb = SERATO_COLOURS[
-                len(self.cue_points) % len(SERATO_COLOURS)
-            ]
-        cue_point.cue_position += self.offset_sec
-        self.cue_points.append(cue_point)
@@ -1,39 +1,67 @@
 # Core logic borrowed from https://github.com/FrankwaP/mixxx-utils
 
+import functools
 from logging import ERROR
 from pathlib import Path
-from typing import Literal
+from types import ModuleType
+from typing import TYPE_CHECKING, Literal
 
-import eyed3.mp3.headers  # type: ignore
+if TYPE_CHECKING:
+    import eyed3.mp3  # type: ignore
 
 
 Mp3Decoder = Literal["MAD", "CoreAudio", "FFmpeg"]
 ACCEPTED_MP3_DECODERS: list[Mp3Decoder] = ["MAD", "CoreAudio", "FFmpeg"]
-
-
-eyed3.core.log.setLevel(ERROR)
-eyed3.id3.frames.log.setLevel(ERROR)
-eyed3.mp3.headers.log.setLevel(ERROR)
-
-OFFSET_ERROR_MESSAGES: list[str] = []
-
-
-def has_xing_info(audiofile: eyed3.mp3.Mp3AudioFile) -> bool:
+Mp3Case = Literal["A", "B", "C", "D"]
+
+# Enough to hold the first frame of any MP3
+MP3_PROBE_SIZE = 4096
+ID3V2_HEADER_SIZE = 10
+
+# Bitrates in kbps, keyed by (MPEG-1, layer)
+MP3_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates keyed by the version bits, 0 being MPEG-2.5 and 1 reserved
+MP3_SAMPLE_RATES = {
+    0: (11025, 12000, 8000),
+    2: (22050, 24000, 16000),
+    3: (44100, 48000, 32000),
+}
+
+
+@functools.cache
+def load_eyed3() -> ModuleType:
+    # Only needed for files the header probe can't read, so it isn't imported until then
+    import eyed3.mp3.headers  # type: ignore
+
+    eyed3.core.log.setLevel(ERROR)
+    eyed3.id3.frames.log.setLevel(ERROR)
+    eyed3.mp3.headers.log.setLevel(ERROR)
+    return eyed3
+
+
+def has_xing_info(audiofile: "eyed3.mp3.Mp3AudioFile") -> bool:
     return audiofile.info.xing_header is not None
 
 
-def has_lame_tag(audiofile: eyed3.mp3.Mp3AudioFile) -> bool:
+def has_lame_tag(audiofile: "eyed3.mp3.Mp3AudioFile") -> bool:
     return len(audiofile.info.lame_tag) > 0
 
 
-def has_valid_CRC_tag(audiofile: eyed3.mp3.Mp3AudioFile) -> bool:
+def has_valid_CRC_tag(audiofile: "eyed3.mp3.Mp3AudioFile") -> bool:
     try:
         return audiofile.info.lame_tag["music_crc"] > 0
     except KeyError:
         return False
 
 
-def get_case_mp3(audiofile: eyed3.mp3.Mp3AudioFile) -> Literal["A", "B", "C", "D"]:
+def get_case_mp3(audiofile: "eyed3.mp3.Mp3AudioFile") -> Mp3Case:
     if not has_xing_info(audiofile):
         return "A"
     elif not has_lame_tag(audiofile):
@@ -44,10 +72,83 @@ def get_case_mp3(audiofile: eyed3.mp3.Mp3AudioFile) -> Literal["A", "B", "C", "D
         return "D"
 
 
-def get_offset_mp3(audiofile: eyed3.mp3.Mp3AudioFile, mp3_decoder: Mp3Decoder) -> int:
+def get_id3v2_size(header: bytes) -> int:
+    if len(header) < ID3V2_HEADER_SIZE or header[:3] != b"ID3":
+        return 0
+    # Tag sizes are syncsafe, only the low 7 bits of each byte count
+    tag_size = 0
+    for size_byte in header[6:10]:
+        tag_size = (tag_size << 7) | (size_byte & 0x7F)
+    has_footer = header[5] & 0x10
+    return ID3V2_HEADER_SIZE + tag_size + (ID3V2_HEADER_SIZE if has_footer else 0)
+
+
+def get_mp3_frame_length(header: int) -> int | None:
+    if header >> 21 != 0x7FF:
+        return None
+    version = (header >> 19) & 0x3
+    layer = 4 - ((header >> 17) & 0x3)
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 0x3
+    if version == 1 or layer == 4 or bitrate_index in (0, 0xF):
+        return None
+    if sample_rate_index == 0x3:
+        return None
+    bitrate = MP3_BITRATES[(version == 3, layer)][bitrate_index] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 0x1
+    # Matches the frame length eyed3 reads, which uses the MPEG-1 slot count for every version
+    if layer == 1:
+        return int((12 * bitrate / sample_rate + padding) * 4)
+    return int(144 * bitrate / sample_rate + padding)
+
+
+def get_xing_position(frame: bytes) -> int:
+    is_mpeg1 = (frame[1] >> 3) & 0x1
+    is_mono = (frame[3] >> 6) & 0x3 == 3
+    # The Xing header follows the 4 byte frame header and the side information
+    if is_mpeg1:
+        return 4 + (17 if is_mono else 32)
+    return 4 + (9 if is_mono else 17)
+
+
+def probe_case_mp3(track_path: str | Path) -> Mp3Case | None:
+    # Only reads the first frame rather than parsing the whole file with eyed3
+    with open(track_path, "rb") as track_file:
+        track_file.seek(get_id3v2_size(track_file.read(ID3V2_HEADER_SIZE)))
+        frame = track_file.read(MP3_PROBE_SIZE)
+        # Anything other than a frame straight after the tag, e.g. padding or junk, is left to eyed3.
+        # A 0xFE after the sync byte is skipped by eyed3 as a UTF-16 byte order mark.
+        if len(frame) < 4 or frame[1] == 0xFE:
+            return None
+        frame_length = get_mp3_frame_length(int.from_bytes(frame[:4], "big"))
+        if not frame_length:
+            return None
+        if frame_length > len(frame):
+            frame += track_file.read(frame_length - len(frame))
+    frame = frame[:frame_length]
+
+    xing_pos = get_xing_position(frame)
+    if frame[xing_pos : xing_pos + 4] not in (b"Xing", b"Info"):
+        return "A"
+    lame_pos = frame.find(b"LAME")
+    if lame_pos == -1:
+        return "B"
+    # The LAME tag's music CRC sits 32 bytes after its "LAME" version string
+    music_crc = int.from_bytes(frame[lame_pos + 32 : lame_pos + 34], "big")
+    if not music_crc:
+        return "C"
+    return "D"
+
+
+def load_case_mp3(track_path: str | Path) -> Mp3Case:
+    # eyed3 copes with files the header probe can't, e.g. junk before the first frame
+    return probe_case_mp3(track_path) or get_case_mp3(load_eyed3().load(track_path))
+
+
+def get_offset_mp3(case: Mp3Case, mp3_decoder: Mp3Decoder) -> int:
     check_mp3_decoder_value(mp3_decoder)
     #
-    case = get_case_mp3(audiofile)
     if mp3_decoder == "MAD":
         if case == "A" or case == "D":
             return 26
@@ -73,28 +174,29 @@ def check_mp3_decoder_value(mp3_decoder: str) -> None:
         )
 
 
-def get_offset_ms(track_path: str | Path, mp3_decoder: Mp3Decoder) -> int:
+def is_offset_in_file(track_path: str | Path) -> bool:
+    # Other formats' offsets only depend on the file extension
+    return Path(track_path).suffix == ".mp3"
+
+
+def probe_offset_ms(
+    track_path: str | Path, mp3_decoder: Mp3Decoder
+) -> tuple[int, str | None]:
     path = Path(track_path)
     if path.suffix == ".m4a":
-        return 48
+        return 48, None
     if path.suffix == ".mp3":
         try:
-            audiofile = eyed3.load(track_path)
-            return get_offset_mp3(audiofile, mp3_decoder)
+            return get_offset_mp3(load_case_mp3(track_path), mp3_decoder), None
         except Exception as ex:
-            OFFSET_ERROR_MESSAGES.append(f"{track_path}: {ex}")
-            return 0
-    return 0
-
-
-def get_offset_sec(track_path: str | Path, mp3_decoder: Mp3Decoder = "MAD") -> float:
-    return get_offset_ms(track_path, mp3_decoder) / 1000.0
+            return 0, str(ex)
+    return 0, None
 
 
-def flush_offset_errors() -> None:
-    if not OFFSET_ERROR_MESSAGES:
+def flush_offset_errors(offset_errors: dict[str, str]) -> None:
+    if not offset_errors:
         return
     print("Unable to determine offsets for the following tracks:")
-    for error_message in OFFSET_ERROR_MESSAGES:
-        print(error_message)
-    OFFSET_ERROR_MESSAGES.clear()
+    for track_path, error_message in offset_errors.items():
+        print(f"{track_path}: {error_message}")
+    offset_errors.clear()
@@ -1,30 +1,19 @@
+from collections.abc import Iterable
 from lxml import etree
 from lxml.builder import E
 import platform
+from typing import BinaryIO
 
 from models import ExportedTrack
 
-TRACK_COLLECTION: dict[str, ExportedTrack] = {}
+XML_DECLARATION = b'<?xml version="1.0" encoding="utf-8"?>\n'
+INDENT = "  "
 
 
 def format_track_id(track_id: int | str) -> str:
     return f"{int(track_id):010}"
 
 
-def is_track_in_collection(track_id: str) -> bool:
-    return track_id in TRACK_COLLECTION
-
-
-def add_track_to_collection(track: ExportedTrack) -> None:
-    TRACK_COLLECTION[track.id] = track
-
-
-def find_or_create_element(
-    index: int, name: str, root: etree.Element, *args, **kwargs
-) -> etree.Element:
-    return root[index] if len(root) > index else E(name, *args, **kwargs)
-
-
 def set_length_key(key: str, element: etree.Element) -> None:
     element.set(key, str(len(element)))
 
@@ -48,22 +37,23 @@ def create_track_elm(track: ExportedTrack) -> etree.Element:
     )
 
     if track.beat_grid:
-        tempo_elm = E.TEMPO(
-            Inizio=str(track.beat_grid.start_sec),
-            Bpm=str(track.beat_grid.bpm or track.track_context.bpm),
-            Metro="4/4",
-            Battito="1",
-        )
-        track_elm.append(tempo_elm)
+        for start_sec, bpm, beat_number in track.beat_grid.tempo_segments:
+            tempo_elm = E.TEMPO(
+                Inizio=str(start_sec),
+                Bpm=str(bpm or track.track_context.bpm),
+                Metro="4/4",
+                Battito=str(beat_number),
+            )
+            track_elm.append(tempo_elm)
 
     for cue_point in track.cue_points:
         cue_elm = E.POSITION_MARK(
-            Name=cue_point.cue_text.rstrip("\x00"),
+            Name="",
             Num=str(cue_point.cue_index),
             Start=str(cue_point.cue_position / 1000),
-            Red=str(cue_point.cue_color.r_int),
-            Green=str(cue_point.cue_color.g_int),
-            Blue=str(cue_point.cue_color.b_int),
+            Red=str(cue_point.red),
+            Green=str(cue_point.green),
+            Blue=str(cue_point.blue),
             Type="0",
         )
         track_elm.append(cue_elm)
@@ -74,52 +64,141 @@ def create_playlist_track_elm(track_id: str) -> etree.Element:
     return E.TRACK(Key=track_id)
 
 
-def generate_xml(
-    tracks: list[ExportedTrack],
-    playlist_name,
-    dj_playlist: etree.Element | None,
-) -> etree.Element:
-    if dj_playlist is None:
-        dj_playlist = E.DJ_PLAYLISTS(
-            E.PRODUCT(Name="rekordbox", Version="6.5.2", Company="AlphaTheta"),
-            Version="1.0.0",
-        )
-
-    collection_elm = find_or_create_element(1, "COLLECTION", dj_playlist)
-
-    playlist_elm = find_or_create_element(2, "PLAYLISTS", dj_playlist)
-    playlist_node_wrapper_elm = find_or_create_element(
-        0, "NODE", playlist_elm, Type="0", Name="ROOT"
-    )
+def create_playlist_node_elm(playlist_name: str, track_ids: list[str]) -> etree.Element:
     playlist_node_elm = E.NODE(Name=playlist_name, Type="1", KeyType="0")
+    for track_id in track_ids:
+        playlist_node_elm.append(create_playlist_track_elm(track_id))
+    set_length_key("Entries", playlist_node_elm)
+    return playlist_node_elm
+
+
+def create_product_elm() -> etree.Element:
+    return E.PRODUCT(Name="rekordbox", Version="6.5.2", Company="AlphaTheta")
+
+
+def write_indented_element(
+    xml_file: etree.xmlfile, element: etree.Element, level: int
+) -> None:
+    etree.indent(element, space=INDENT, level=level)
+    xml_file.write("\n" + INDENT * level)
+    xml_file.write(element)
+
+
+def write_xml(
+    fd: BinaryIO,
+    tracks: Iterable[ExportedTrack],
+    track_count: int,
+    playlists: list[tuple[str, list[str]]],
+) -> None:
+    # Elements are serialised as soon as they're produced, so the document is never held in memory
+    fd.write(XML_DECLARATION)
+    with etree.xmlfile(fd, encoding="utf-8") as xml_file:
+        with xml_file.element("DJ_PLAYLISTS", Version="1.0.0"):
+            write_indented_element(xml_file, create_product_elm(), 1)
+            xml_file.write("\n" + INDENT)
+            with xml_file.element("COLLECTION", Entries=str(track_count)):
+                for track in tracks:
+                    write_indented_element(xml_file, create_track_elm(track), 2)
+                xml_file.write("\n" + INDENT)
+            xml_file.write("\n" + INDENT)
+            with xml_file.element("PLAYLISTS"):
+                xml_file.write("\n" + INDENT * 2)
+                with xml_file.element(
+                    "NODE", Type="0", Name="ROOT", Count=str(len(playlists))
+                ):
+                    for playlist_name, track_ids in playlists:
+                        write_indented_element(
+                            xml_file,
+                            create_playlist_node_elm(playlist_name, track_ids),
+                            3,
+                        )
+                    xml_file.write("\n" + INDENT * 2)
+                xml_file.write("\n" + INDENT)
+            xml_file.write("\n")
+    fd.write(b"\n")
+
+
+def write_xml_element(fd: BinaryIO, xml_element: etree.Element) -> None:
+    fd.write(XML_DECLARATION)
+    etree.ElementTree(xml_element).write(fd, pretty_print=True, encoding="utf-8")
+
+
+def read_xml(xml_location: str) -> etree.Element:
+    return etree.parse(
+        xml_location, etree.XMLParser(remove_blank_text=True, huge_tree=True)
+    ).getroot()
+
+
+def is_element_changed(old_element: etree.Element, new_element: etree.Element) -> bool:
+    return etree.tostring(old_element, with_tail=False) != etree.tostring(
+        new_element, with_tail=False
+    )
 
-    for track in tracks:
-        playlist_node_elm.append(create_playlist_track_elm(track.id))
 
-        if is_track_in_collection(track.id):
-            continue
-        collection_elm.append(create_track_elm(track))
-        add_track_to_collection(track)
+def replace_changed_element(
+    parent: etree.Element,
+    old_element: etree.Element | None,
+    new_element: etree.Element,
+) -> bool:
+    if old_element is None:
+        parent.append(new_element)
+        return True
+    if not is_element_changed(old_element, new_element):
+        return False
+    parent.replace(old_element, new_element)
+    return True
+
+
+def update_xml(
+    tracks: Iterable[ExportedTrack],
+    playlists: list[tuple[str, list[str]]],
+    dj_playlist: etree.Element,
+    collection_names: set[str],
+) -> tuple[etree.Element, int, int]:
+    collection_elm = dj_playlist.find("COLLECTION")
+    playlist_node_wrapper_elm = dj_playlist.find("PLAYLISTS/NODE")
+    if collection_elm is None or playlist_node_wrapper_elm is None:
+        raise Exception(
+            "Existing rekordbox XML is missing its collection or playlists."
+        )
 
-    playlist_node_wrapper_elm.append(playlist_node_elm)
-    playlist_elm.append(playlist_node_wrapper_elm)
+    track_elms = {track_elm.get("TrackID"): track_elm for track_elm in collection_elm}
+    playlist_node_elms = {
+        playlist_node_elm.get("Name"): playlist_node_elm
+        for playlist_node_elm in playlist_node_wrapper_elm
+    }
+    changed_tracks = 0
+    for track in tracks:
+        if replace_changed_element(
+            collection_elm, track_elms.pop(track.id, None), create_track_elm(track)
+        ):
+            changed_tracks += 1
+
+    changed_playlists = 0
+    for playlist_name, track_ids in playlists:
+        if replace_changed_element(
+            playlist_node_wrapper_elm,
+            playlist_node_elms.pop(playlist_name, None),
+            create_playlist_node_elm(playlist_name, track_ids),
+        ):
+            changed_playlists += 1
+
+    # Playlists deleted or renamed in Mixxx are removed, ones that just weren't selected this time are kept
+    for playlist_name, playlist_node_elm in playlist_node_elms.items():
+        if playlist_name not in collection_names:
+            playlist_node_wrapper_elm.remove(playlist_node_elm)
+            changed_playlists += 1
+    # As in a full export, the collection only keeps tracks that are in a playlist
+    playlist_track_ids = {
+        playlist_track_elm.get("Key")
+        for playlist_track_elm in playlist_node_wrapper_elm.iter("TRACK")
+    }
+    for track_id, track_elm in track_elms.items():
+        if track_id not in playlist_track_ids:
+            collection_elm.remove(track_elm)
+            changed_tracks += 1
 
     set_length_key("Entries", collection_elm)
-    set_length_key("Entries", playlist_node_elm)
     set_length_key("Count", playlist_node_wrapper_elm)
 
-    dj_playlist.append(collection_elm)
-    dj_playlist.append(playlist_elm)
-
-    return dj_playlist
-
-
-def encode_xml_element(xml_element: etree.Element) -> str:
-    s = etree.tostring(xml_element, pretty_print=True, encoding="utf-8")
-    s = str(s, "utf-8")
-    s = (
-        s
-        if s.startswith("<?xml")
-        else '<?xml version="1.0" encoding="%s"?>\n%s' % ("utf-8", s)
-    )
-    return s.encode("utf-8")
+    return dj_playlist, changed_tracks, changed_playlists
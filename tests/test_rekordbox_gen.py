@@ -0,0 +1,107 @@
+from pathlib import Path
+import sys
+import tempfile
+import unittest
+
+from lxml import etree
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import ExportedTrack, TrackContext
+from rekordbox_gen import format_track_id, read_xml, update_xml, write_xml
+
+
+def create_track(track_id: int, title: str) -> ExportedTrack:
+    return ExportedTrack(
+        format_track_id(track_id),
+        TrackContext(
+            id=track_id,
+            title=title,
+            artist="Artist",
+            album="Album",
+            genre="House",
+            duration=300,
+            location=f"/music/track{track_id}.mp3",
+            samplerate=44100,
+            channels=2,
+            bpm=124.0,
+            key="8A",
+            rating=0,
+            colour="",
+        ),
+        None,
+        [],
+    )
+
+
+def create_dj_playlist(
+    tracks: list[ExportedTrack], playlists: list[tuple[str, list[str]]]
+) -> etree.Element:
+    # Written and read back as --update does, so unchanged elements compare equal
+    with tempfile.TemporaryDirectory() as work_dir:
+        xml_location = str(Path(work_dir).joinpath("rekordbox.xml"))
+        with open(xml_location, "wb") as fd:
+            write_xml(fd, tracks, len(tracks), playlists)
+        return read_xml(xml_location)
+
+
+def get_playlist_names(dj_playlist: etree.Element) -> list[str]:
+    return [node.get("Name") for node in dj_playlist.find("PLAYLISTS/NODE")]
+
+
+def get_track_titles(dj_playlist: etree.Element) -> dict[str, str]:
+    return {
+        track_elm.get("TrackID"): track_elm.get("Name")
+        for track_elm in dj_playlist.find("COLLECTION")
+    }
+
+
+class UpdateXmlTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tracks = [
+            create_track(track_id, f"Title {track_id}") for track_id in [1, 2, 3]
+        ]
+        self.dj_playlist = create_dj_playlist(
+            self.tracks,
+            [
+                ("Warm up", [format_track_id(1), format_track_id(2)]),
+                ("Peak time", [format_track_id(3)]),
+            ],
+        )
+
+    def test_selective_update_keeps_unselected_playlists(self) -> None:
+        dj_playlist, changed_tracks, changed_playlists = update_xml(
+            [create_track(1, "New title 1")],
+            [("Warm up", [format_track_id(1)])],
+            self.dj_playlist,
+            {"Warm up", "Peak time"},
+        )
+
+        self.assertEqual(get_playlist_names(dj_playlist), ["Warm up", "Peak time"])
+        # Track 2 left the only playlist it was in, track 3 is still in an unselected one
+        self.assertEqual(
+            get_track_titles(dj_playlist),
+            {format_track_id(1): "New title 1", format_track_id(3): "Title 3"},
+        )
+        self.assertEqual(dj_playlist.find("COLLECTION").get("Entries"), "2")
+        self.assertEqual(dj_playlist.find("PLAYLISTS/NODE").get("Count"), "2")
+        self.assertEqual((changed_tracks, changed_playlists), (2, 1))
+
+    def test_update_removes_playlists_deleted_in_mixxx(self) -> None:
+        dj_playlist, changed_tracks, changed_playlists = update_xml(
+            self.tracks[:2],
+            [("Warm up", [format_track_id(1), format_track_id(2)])],
+            self.dj_playlist,
+            {"Warm up"},
+        )
+
+        self.assertEqual(get_playlist_names(dj_playlist), ["Warm up"])
+        self.assertEqual(
+            list(get_track_titles(dj_playlist)),
+            [format_track_id(1), format_track_id(2)],
+        )
+        self.assertEqual((changed_tracks, changed_playlists), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()